@@ -1,32 +1,123 @@
-import boto3
-from botocore.config import Config
-from botocore.exceptions import BotoCoreError, ClientError
+import hashlib
+import io
+import os
+import tempfile
+
 import frappe
 import requests
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
 from frappe import _
-from jinja2 import Template
+
+from whatsapp_integration.api.contacts import (
+    get_document_parties,
+    get_party_field,
+    get_whatsapp_numbers_for_parties,
+)
+from whatsapp_integration.api.gateway import post_to_gateway
+from whatsapp_integration.api.message_log import insert_message_logs, make_message_log
+from whatsapp_integration.api.metrics import timed
+from whatsapp_integration.api.phone import PhoneNumberError
+from whatsapp_integration.api.phone import normalize as normalize_phone
+from whatsapp_integration.api.pipeline import StageError, get_stage_timeout, run_stages
+from whatsapp_integration.api.s3 import get_s3_client, get_transfer_config, presign_get_object_url
+from whatsapp_integration.api.templates import (
+    get_compiled_template,
+    get_compiled_template_cache_stats,
+    get_enabled_template,
+    get_render_doc,
+)
+
+# Uploaded PDFs (object key and ETag) remembered per document fingerprint
+PDF_ARTIFACT_CACHE_PREFIX = 'whatsapp_pdf_artifact'
+PDF_ARTIFACT_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Presigned URLs per object key and expiry; reused until half their validity is gone
+PRESIGNED_URL_CACHE_PREFIX = 'whatsapp_presigned_url'
+
+# Validity of the PDF link sent through the gateway; a reused link has at least half of it left
+ATTACHMENT_LINK_EXPIRY = 12 * 60 * 60
+
+# Validity of the PDF link in wa.me messages; a reused link has at least half of it left
+PRESIGNED_LINK_EXPIRY = 7 * 24 * 60 * 60
+
+# Repeated sends of the same document revision to the same phone return the first outbox
+SEND_DEDUP_CACHE_PREFIX = 'whatsapp_send_dedup'
+DEFAULT_SEND_DEDUP_TTL = 10 * 60
+
+# Default timeout (seconds) of the PDF link stage of prepare_whatsapp_presigned_message
+PDF_STAGE_TIMEOUT = 90
+
+# Streamed PDFs are spooled to disk past this size before upload, and streamed in chunks of this size
+PDF_SPOOL_MAX_MEMORY = 4 * 1024 * 1024
+PDF_STREAM_CHUNK_SIZE = 256 * 1024
+
+
+# Field types to exclude from the template field picker
+EXCLUDED_TEMPLATE_FIELDTYPES = [
+    'Table', 'Table MultiSelect', 'HTML', 'HTML Editor', 'Button',
+    'Section Break', 'Column Break', 'Tab Break', 'Heading', 'Code',
+    'Password', 'Attach', 'Attach Image', 'Signature', 'Geolocation',
+    'Duration', 'Rating', 'Color', 'Icon', 'Barcode', 'Image'
+]
+
+# System fields to exclude from the template field picker
+EXCLUDED_TEMPLATE_FIELDNAMES = [
+    'modified', 'modified_by', 'creation', 'owner', 'docstatus', 
+    'idx', 'parent', 'parenttype', 'parentfield', '_user_tags', 
+    '_comments', '_assign', '_liked_by', 'workflow_state', 
+    'amended_from', 'print_language'
+]
+
+# Redis hash of doctype -> {'version': meta version, 'fields': categorized fields}
+DOCTYPE_FIELDS_CACHE_KEY = 'whatsapp_doctype_fields'
+
 
 @frappe.whitelist()
 def get_doctype_fields(doctype):
-    """Get all fields for a doctype that can be used in templates, organized by category"""
+    """Get all fields for a doctype that can be used in templates, organized by category.
+
+    Cached per doctype against a version of its meta (and its child tables'),
+    so the list is only rebuilt after the DocType or its customizations change.
+    """
     meta = frappe.get_meta(doctype)
-    
-    # Field types to exclude
-    excluded_fieldtypes = [
-        'Table', 'Table MultiSelect', 'HTML', 'HTML Editor', 'Button',
-        'Section Break', 'Column Break', 'Tab Break', 'Heading', 'Code',
-        'Password', 'Attach', 'Attach Image', 'Signature', 'Geolocation',
-        'Duration', 'Rating', 'Color', 'Icon', 'Barcode', 'Image'
-    ]
-    
-    # System fields to exclude
-    excluded_fieldnames = [
-        'modified', 'modified_by', 'creation', 'owner', 'docstatus', 
-        'idx', 'parent', 'parenttype', 'parentfield', '_user_tags', 
-        '_comments', '_assign', '_liked_by', 'workflow_state', 
-        'amended_from', 'print_language'
-    ]
-    
+    version = get_meta_version(meta)
+
+    cached = frappe.cache().hget(DOCTYPE_FIELDS_CACHE_KEY, doctype)
+    if cached and cached.get('version') == version:
+        return cached['fields']
+
+    fields = build_doctype_fields(meta)
+    frappe.cache().hset(DOCTYPE_FIELDS_CACHE_KEY, doctype, {'version': version, 'fields': fields})
+    return fields
+
+
+def get_meta_version(meta):
+    """Fingerprint of a doctype's meta, its custom fields and its child tables' metas."""
+    metas = [meta] + [frappe.get_meta(df.options) for df in meta.get_table_fields()]
+    parts = []
+    for m in metas:
+        custom_modified = max((str(df.modified) for df in m.fields if df.get('is_custom_field')), default='')
+        parts.append(f"{m.name}:{m.modified}:{custom_modified}:{len(m.fields)}")
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def clear_doctype_fields_cache(doc=None, method=None, *args, **kwargs):
+    """doc_events handler for DocType, Custom Field and Property Setter changes."""
+    frappe.cache().delete_value(DOCTYPE_FIELDS_CACHE_KEY)
+
+
+def is_template_field(field):
+    return not (
+        field.fieldtype in EXCLUDED_TEMPLATE_FIELDTYPES or 
+        field.fieldname in EXCLUDED_TEMPLATE_FIELDNAMES or 
+        field.hidden or 
+        field.fieldname.startswith('_')
+    )
+
+
+def build_doctype_fields(meta):
+    """Categorize a doctype's template fields, followed by its child table fields."""
     # Categorize fields for better organization
     important_fields = []
     date_fields = []
@@ -36,10 +127,7 @@ def get_doctype_fields(doctype):
     
     for field in meta.fields:
         # Skip excluded field types and names
-        if (field.fieldtype in excluded_fieldtypes or 
-            field.fieldname in excluded_fieldnames or 
-            field.hidden or 
-            field.fieldname.startswith('_')):
+        if not is_template_field(field):
             continue
         
         field_info = {
@@ -84,62 +172,49 @@ def get_doctype_fields(doctype):
         amount_fields +     # Then amounts
         date_fields +       # Then dates
         other_fields +      # Then other structured data
-        text_fields         # Text fields last (usually long)
+        text_fields +       # Text fields (usually long)
+        get_child_table_fields(meta)  # Child table rows last
     )
     
     return all_fields
 
+
+def get_child_table_fields(meta):
+    """Fields of the doctype's child tables, with a loop snippet to use them in a template."""
+    child_fields = []
+    for table in meta.get_table_fields():
+        if table.hidden:
+            continue
+        table_label = table.label or table.fieldname.replace('_', ' ').title()
+        for field in frappe.get_meta(table.options).fields:
+            if not is_template_field(field):
+                continue
+            child_fields.append({
+                'fieldname': f"{table.fieldname}.{field.fieldname}",
+                'label': f"{table_label}: {field.label or field.fieldname.replace('_', ' ').title()}",
+                'fieldtype': field.fieldtype,
+                'description': field.description or '',
+                'parentfield': table.fieldname,
+                'template': (
+                    f"{{% for row in doc.{table.fieldname} %}}"
+                    f"{{{{ row.{field.fieldname} }}}}"
+                    "{% endfor %}"
+                ),
+            })
+    return child_fields
+
 @frappe.whitelist()
 def get_whatsapp_contacts(doctype, docname):
     """Get WhatsApp enabled contacts for a document"""
-    doc = frappe.get_doc(doctype, docname)
-    contacts = []
-    
-    # Get customer field (might be 'customer' or 'party_name' etc.)
-    customer_field = None
-    if hasattr(doc, 'customer'):
-        customer_field = 'customer'
-        customer = doc.customer
-    elif hasattr(doc, 'party_name'):
-        customer_field = 'party_name'
-        customer = doc.party_name
-    
-    if not customer_field:
+    # Get party field (customer, party_name, supplier... or a site config override)
+    if not get_party_field(doctype):
         frappe.throw(_("No customer field found in this document"))
-    
-    # Get all contacts linked to this customer via Dynamic Link
-    contact_links = frappe.get_all('Dynamic Link',
-        filters={
-            'link_doctype': 'Customer',
-            'link_name': customer,
-            'parenttype': 'Contact'
-        },
-        fields=['parent'],
-        distinct=True
-    )
-    
-    # Fetch contacts and filter WhatsApp-enabled phone numbers
-    for link in contact_links:
-        try:
-            contact = frappe.get_doc('Contact', link.parent)
-            
-            # Check each phone number in the contact
-            for phone in contact.phone_nos:
-                if phone.custom_is_whatsapp_enabled and phone.phone:
-                    contact_display = contact.first_name or contact.name
-                    if contact.last_name:
-                        contact_display += ' ' + contact.last_name
-                    
-                    contacts.append({
-                        'contact_name': contact.name,
-                        'contact_display': contact_display,
-                        'phone': phone.phone,
-                        'is_primary': phone.is_primary_mobile_no or False
-                    })
-        except Exception as e:
-            frappe.log_error(message=f"Error fetching contact {link.parent}: {str(e)}", title="WhatsApp Get Contacts")
-            continue
-    
+
+    party_doctype, customer = get_document_parties(doctype, [docname]).get(docname, (None, None))
+
+    # Contacts linked to this party via Dynamic Link, primary numbers first
+    contacts = get_whatsapp_numbers_for_parties([(party_doctype, customer)]).get((party_doctype, customer), [])
+
     if not contacts:
         frappe.msgprint(
             _("No WhatsApp-enabled phone numbers found for customer {0}. Please enable WhatsApp on at least one contact number.").format(customer),
@@ -150,122 +225,188 @@ def get_whatsapp_contacts(doctype, docname):
 
 
 @frappe.whitelist()
-def send_whatsapp_message(doctype, docname, phone, contact_name=None):
-    """Send WhatsApp message using template"""
-    # Get the document
-    doc = frappe.get_doc(doctype, docname)
-    
-    # Get the WhatsApp template for this doctype
-    templates = frappe.get_all('Whatsapp Template',
-        filters={
-            'reference_doctype': doctype,
-            'enabled': 1
-        },
-        limit=1
-    )
-    
-    if not templates:
+def send_whatsapp_message(doctype, docname, phone, contact_name=None, idempotency_key=None):
+    """Queue a WhatsApp message for a document using its template.
+
+    Only cheap checks run in the request; rendering, PDF upload and the gateway
+    call happen in a background job for the returned Whatsapp Outbox entry,
+    which pushes its status changes over realtime.
+
+    Calls are idempotent: a repeat with the same `idempotency_key` (by default
+    derived from the document, its `modified` and the phone) within
+    `whatsapp_send_dedup_ttl` seconds returns the first call's outbox instead
+    of sending again, unless that send failed.
+    """
+    frappe.has_permission(doctype, 'read', docname, throw=True)
+
+    with timed('template', doctype):
+        template_doc = get_enabled_template(doctype)
+    if not template_doc:
         frappe.throw(_("No WhatsApp template found for {0}").format(doctype))
-    
-    template_doc = frappe.get_doc('Whatsapp Template', templates[0].name)
-    
-    # Render the message template
-    try:
-        if template_doc.use_html:
-            jinja_template = Template(template_doc.response_html)
-        else:
-            jinja_template = Template(template_doc.response)
-        
-        message = jinja_template.render(doc=doc)
-    except Exception as e:
-        frappe.log_error(f"Template rendering failed: {str(e)}", "WhatsApp Template Render")
-        frappe.throw(_("Failed to render message template: {0}").format(str(e)))
-    
+
     # Clean and format phone number
     phone = format_whatsapp_phone(phone)
-    
+
+    if not idempotency_key:
+        modified = frappe.db.get_value(doctype, docname, 'modified')
+        idempotency_key = f"{doctype}|{docname}|{phone}|{modified}"
+
+    dedup_key = get_send_dedup_key(idempotency_key)
+    if not claim_send(dedup_key):
+        return get_duplicate_send_result(dedup_key)
+
+    try:
+        outbox = frappe.get_doc({
+            'doctype': 'Whatsapp Outbox',
+            'reference_doctype': doctype,
+            'reference_name': docname,
+            'phone': phone,
+            'contact_name': contact_name,
+            'whatsapp_template': template_doc.name,
+        }).insert(ignore_permissions=True)
+    except Exception:
+        frappe.cache().delete(dedup_key)
+        raise
+
+    frappe.cache().set(dedup_key, outbox.name, ex=get_send_dedup_ttl())
+
+    return {
+        'success': True,
+        'queued': True,
+        'outbox': outbox.name,
+        'status': outbox.status,
+    }
+
+
+def get_send_dedup_key(idempotency_key):
+    digest = hashlib.sha1(str(idempotency_key).encode('utf-8')).hexdigest()
+    return frappe.cache().make_key(f"{SEND_DEDUP_CACHE_PREFIX}:{digest}")
+
+
+def get_send_dedup_ttl():
+    return int(frappe.conf.get('whatsapp_send_dedup_ttl') or DEFAULT_SEND_DEDUP_TTL)
+
+
+def claim_send(dedup_key):
+    """Atomically claim a send; False if an earlier call already claimed it.
+
+    A claim whose outbox has failed is taken over, so a real retry still sends.
+    """
+    cache = frappe.cache()
+    if cache.set(dedup_key, 'pending', nx=True, ex=get_send_dedup_ttl()):
+        return True
+
+    outbox_name = frappe.safe_decode(cache.get(dedup_key) or '')
+    if outbox_name not in ('', 'pending') \
+            and frappe.db.get_value('Whatsapp Outbox', outbox_name, 'status') == 'Failed':
+        cache.set(dedup_key, 'pending', ex=get_send_dedup_ttl())
+        return True
+    return False
+
+
+def get_duplicate_send_result(dedup_key):
+    """The result of the original send, for a repeated call."""
+    outbox_name = frappe.safe_decode(frappe.cache().get(dedup_key) or '')
+    if outbox_name in ('', 'pending'):
+        # The first call has not finished inserting its outbox yet
+        outbox_name = None
+    status = outbox_name and frappe.db.get_value('Whatsapp Outbox', outbox_name, 'status')
+
+    return {
+        'success': True,
+        'queued': True,
+        'duplicate': True,
+        'outbox': outbox_name,
+        'status': status or 'Queued',
+    }
+
+
+def deliver_whatsapp_message(doc, template_doc, phone, contact_name=None, on_stage=None,
+        message_log=None, outbox=None, sender=None):
+    """Render, send and log a WhatsApp message for `doc` synchronously.
+
+    `on_stage`, if given, is called with "Rendering" and "Uploading" as the
+    send progresses. Returns the gateway result. Each stage is timed into the
+    metrics served by `whatsapp_integration.api.metrics.get_metrics`.
+
+    The send is recorded as a Whatsapp Message Log row. Batch callers pass a
+    `message_log` list to collect the rows and write them together with
+    `insert_message_logs` once the batch is done. `sender` is the user the
+    log names, the session user by default; background jobs pass the user
+    who queued the message.
+    """
+    doctype = doc.doctype
+
+    with timed('send', doctype):
+        return _deliver_whatsapp_message(
+            doc, template_doc, phone, contact_name, on_stage, message_log, outbox, sender
+        )
+
+
+def _deliver_whatsapp_message(doc, template_doc, phone, contact_name, on_stage, message_log, outbox, sender):
+    doctype = doc.doctype
+
+    if on_stage:
+        on_stage('Rendering')
+
+    # Render the message template
+    with timed('render', doctype):
+        message = render_template_message(template_doc, doc)
+
     # Send message
     try:
         if template_doc.send_attachment:
+            if on_stage:
+                on_stage('Uploading')
             # Send with PDF attachment
             result = send_with_attachment(doc, phone, message, doctype)
         else:
             # Send text only
-            result = send_text_message(phone, message)
-        
-        # Log the activity in timeline
-        frappe.get_doc({
-            'doctype': 'Comment',
-            'comment_type': 'Info',
-            'reference_doctype': doctype,
-            'reference_name': docname,
-            'content': f'WhatsApp message sent to {contact_name or phone}'
-        }).insert(ignore_permissions=True)
-        
+            with timed('gateway', doctype):
+                result = send_text_message(phone, message)
+
+        # Log the activity; shown in the timeline through `additional_timeline_content`
+        entry = make_message_log(doc, template_doc, phone, contact_name, outbox, sender)
+        if message_log is not None:
+            message_log.append(entry)
+        else:
+            with timed('log', doctype):
+                insert_message_logs([entry])
+
         return result
-        
+
     except Exception as e:
         frappe.log_error(f"WhatsApp send failed: {str(e)}", "WhatsApp Integration")
         frappe.throw(_("Failed to send WhatsApp message: {0}").format(str(e)))
 
 
+def render_template_message(template_doc, doc):
+    """Render the template's message body for `doc` using the compiled template cache."""
+    try:
+        return get_compiled_template(template_doc).render(doc=doc)
+    except Exception as e:
+        frappe.log_error(f"Template rendering failed: {str(e)}", "WhatsApp Template Render")
+        frappe.throw(_("Failed to render message template: {0}").format(str(e)))
+
+
+@frappe.whitelist()
+def get_template_cache_stats():
+    """Return size and hit/miss counters of this worker's compiled template cache."""
+    frappe.only_for('System Manager')
+    return get_compiled_template_cache_stats()
+
+
 def format_whatsapp_phone(phone):
     """
     Format phone number for WhatsApp
     - Remove all special characters
-    - Add country code if missing
-    - Handle Indian numbers (default country code: 91)
+    - Add country code if missing (System Settings country, default 91 / India)
+    See `whatsapp_integration.api.phone` for the full rules and batch variant.
     """
-    if not phone:
-        frappe.throw(_("Phone number is required"))
-    
-    # Remove all non-numeric characters
-    phone = ''.join(filter(str.isdigit, phone))
-    
-    if not phone:
-        frappe.throw(_("Invalid phone number format"))
-    
-    # Get default country code from system settings or use 91 (India)
-    default_country_code = frappe.db.get_single_value('System Settings', 'country') 
-    
-    # Map common countries to their codes
-    country_codes = {
-        'India': '91',
-        'United States': '1',
-        'United Kingdom': '44',
-        'United Arab Emirates': '971',
-        'Saudi Arabia': '966',
-        'Singapore': '65',
-        'Australia': '61',
-        'Canada': '1',
-    }
-    
-    # Default to India if not found
-    default_code = country_codes.get(default_country_code, '91')
-    
-    # Check if phone already has country code
-    # If phone starts with common country codes, don't add prefix
-    common_prefixes = ['1', '44', '91', '971', '966', '65', '61', '86', '81']
-    
-    has_country_code = False
-    for prefix in common_prefixes:
-        if phone.startswith(prefix) and len(phone) > len(prefix) + 8:
-            has_country_code = True
-            break
-    
-    # Add country code if not present
-    if not has_country_code:
-        # Special handling for Indian numbers
-        if len(phone) == 10:  # Indian mobile number without country code
-            phone = default_code + phone
-        elif len(phone) < 10:
-            frappe.throw(_("Phone number is too short. Please provide a valid phone number with country code."))
-    
-    # Validate final length (should be between 10-15 digits)
-    if len(phone) < 10 or len(phone) > 15:
-        frappe.throw(_("Invalid phone number length. Phone number should be between 10-15 digits including country code."))
-    
-    return phone
+    try:
+        return normalize_phone(phone)
+    except PhoneNumberError as e:
+        frappe.throw(str(e))
 
 
 def send_text_message(phone, message):
@@ -279,8 +420,7 @@ def send_text_message(phone, message):
     }
     
     try:
-        response = requests.post(f"{base_url}/sendText", json=wa_payload, timeout=30)
-        response.raise_for_status()
+        response = post_to_gateway(base_url, "/sendText", wa_payload)
         return {"success": True, "response": response.json()}
     except requests.exceptions.RequestException as e:
         frappe.log_error(f"WhatsApp text send failed: {str(e)}", "WhatsApp Send Text")
@@ -288,39 +428,107 @@ def send_text_message(phone, message):
 
 
 def send_with_attachment(doc, phone, caption, doctype):
-    """Send WhatsApp message by uploading PDF to S3 and sharing a 12h presigned URL."""
-    
-    pdf_content = generate_pdf_bytes(doc, doctype)
-    
-    # Upload PDF to S3 and get a short-lived presigned URL
+    """Send WhatsApp message by uploading PDF to S3 and sharing a presigned URL."""
+
+    # Upload PDF to S3 (unless unchanged since last upload) and get a short-lived presigned URL
     try:
-        s3_url = upload_pdf_and_get_presigned_url(doc, doctype, pdf_content, expiry_seconds=12 * 60 * 60)
+        s3_url = get_document_pdf_url(doc, doctype, expiry_seconds=ATTACHMENT_LINK_EXPIRY)
     except Exception as e:
         err = str(e)
         frappe.log_error(message=err, title="WhatsApp S3 Upload")
         frappe.throw(_("Failed to upload to S3 or create presigned URL: {0}").format(err))
 
     # Send text containing the link and an expiry notice
-    link_notice = _("This link will expire in 12 hours.")
+    link_notice = _("This link is valid for at least {0} hours.").format(ATTACHMENT_LINK_EXPIRY // 2 // 3600)
     message_with_link = f"{caption}\n\n{_('Download PDF')}: {s3_url}\n{link_notice}"
 
     try:
-        return send_text_message(phone, message_with_link)
+        with timed('gateway', doctype):
+            return send_text_message(phone, message_with_link)
     except Exception as e:
         frappe.log_error(f"WhatsApp text with S3 link failed: {str(e)}", "WhatsApp Send Text")
         frappe.throw(_("Failed to send WhatsApp message with link: {0}").format(str(e)))
 
 
-def generate_pdf_bytes(doc, doctype):
-    """Generate a PDF for the doc and return its bytes."""
-    print_format = "Standard"
+def generate_pdf_bytes(doc, doctype, print_format=None):
+    """Generate a PDF for the doc and return its bytes.
+
+    Rendered in-process with Frappe's print utilities, so it also works from
+    background jobs. Setting `whatsapp_pdf_via_http` in site config fetches the
+    PDF from the site's own download_pdf endpoint instead, when the caller has
+    a session to forward.
+    """
+    print_format = print_format or get_default_print_format(doctype)
+
+    if frappe.conf.get('whatsapp_pdf_via_http') and get_session_sid():
+        return download_pdf_over_http(doc, doctype, print_format)
+
+    try:
+        pdf_content = frappe.get_print(
+            doctype,
+            doc.name,
+            print_format,
+            doc=doc,
+            as_pdf=True,
+            no_letterhead=0
+        )
+    except Exception as e:
+        frappe.log_error(f"PDF generation failed: {str(e)}", "WhatsApp PDF Generation")
+        frappe.throw(_("Failed to generate PDF: {0}").format(str(e)))
+
+    if not pdf_content:
+        frappe.throw(_("Failed to generate PDF - empty content returned"))
+
+    return pdf_content
+
+
+def generate_pdf_file(doc, doctype, print_format=None):
+    """Generate the doc's PDF and return it as a rewound binary file.
+
+    wkhtmltopdf hands back the whole PDF, so in-process PDFs are wrapped in
+    memory as they are. The HTTP fallback streams the response into a
+    temporary file that rolls over to disk past `PDF_SPOOL_MAX_MEMORY`, so
+    a big print is never held in memory whole. Close the returned file (or
+    use it as a context manager) when done.
+    """
+    print_format = print_format or get_default_print_format(doctype)
+    if not (frappe.conf.get('whatsapp_pdf_via_http') and get_session_sid()):
+        return io.BytesIO(generate_pdf_bytes(doc, doctype, print_format=print_format))
+
+    pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_MEMORY)
+    try:
+        download_pdf_over_http(doc, doctype, print_format, into=pdf_file)
+        pdf_file.seek(0)
+        return pdf_file
+    except Exception:
+        pdf_file.close()
+        raise
+
+
+def get_default_print_format(doctype):
+    """Return the doctype's default print format, falling back to `Standard`."""
     try:
         meta = frappe.get_meta(doctype)
         if hasattr(meta, 'default_print_format') and meta.default_print_format:
-            print_format = meta.default_print_format
+            return meta.default_print_format
     except Exception:
         pass
+    return "Standard"
+
+
+def get_session_sid():
+    """Return the current session id, or None outside a logged-in web request."""
+    session = getattr(frappe.local, 'session', None)
+    return getattr(session, 'sid', None) if session else None
+
 
+def download_pdf_over_http(doc, doctype, print_format, into=None):
+    """Fetch the PDF over HTTP from this site using the caller's session.
+
+    Opt-in fallback only: it ties up a second web worker while this one waits.
+    Returns the PDF bytes, or streams them into the binary file `into` and
+    returns that file instead.
+    """
     site_url = frappe.utils.get_url()
     pdf_url = f"{site_url}/api/method/frappe.utils.print_format.download_pdf"
 
@@ -335,21 +543,28 @@ def generate_pdf_bytes(doc, doctype):
         response = requests.get(
             pdf_url,
             params=params,
-            cookies={"sid": frappe.local.session.sid},
-            timeout=30
+            cookies={"sid": get_session_sid()},
+            timeout=30,
+            stream=into is not None
         )
         response.raise_for_status()
-        pdf_content = response.content
-
-        if not pdf_content:
-            frappe.throw(_("Failed to generate PDF - empty content returned"))
-
-        return pdf_content
-
+        if into is None:
+            pdf_content = response.content
+        else:
+            size = 0
+            for chunk in response.iter_content(chunk_size=PDF_STREAM_CHUNK_SIZE):
+                into.write(chunk)
+                size += len(chunk)
+            pdf_content = into if size else None
     except requests.exceptions.RequestException as e:
         frappe.log_error(f"PDF generation failed: {str(e)}", "WhatsApp PDF Generation")
         frappe.throw(_("Failed to download PDF: {0}").format(str(e)))
 
+    if not pdf_content:
+        frappe.throw(_("Failed to generate PDF - empty content returned"))
+
+    return pdf_content
+
 
 def upload_pdf_and_get_presigned_url(doc, doctype, pdf_bytes, expiry_seconds=43200):
     """Upload PDF bytes to S3 and return a presigned URL valid for `expiry_seconds`.
@@ -357,6 +572,75 @@ def upload_pdf_and_get_presigned_url(doc, doctype, pdf_bytes, expiry_seconds=432
     Configuration is read from the doctype `Whatsapp S3 Configuration`.
     Expected fields: `aws_access_key_id`, `aws_secret_access_key`, `bucket_name`, `region_name` (optional), `folder` (optional).
     """
+    settings = get_s3_settings()
+    s3_client = get_settings_s3_client(settings)
+    key = get_pdf_object_key(doctype, doc.name, settings.folder)
+
+    put_pdf_object(s3_client, settings.bucket_name, key, pdf_bytes)
+    return get_presigned_pdf_url(settings, key, expiry_seconds, s3_client=s3_client)
+
+
+def get_document_pdf_url(doc, doctype, expiry_seconds=43200):
+    """Return a presigned URL for the doc's PDF, uploading it only when needed.
+
+    Uploaded PDFs are remembered by doctype, name, `modified` and print format.
+    When the bucket still holds that exact object (same key and ETag), both PDF
+    generation and the upload are skipped. If this revision was uploaded and a
+    URL for it is still cached, no S3 call is made at all.
+    """
+    print_format = get_default_print_format(doctype)
+    settings = get_s3_settings()
+    bucket_name = settings.bucket_name
+    key = get_pdf_object_key(doctype, doc.name, settings.folder)
+
+    fingerprint = get_pdf_fingerprint(doctype, doc.name, doc.modified, print_format)
+    cache_key = f"{PDF_ARTIFACT_CACHE_PREFIX}:{bucket_name}:{fingerprint}"
+    artifact = frappe.cache().get_value(cache_key)
+    uploaded = artifact and artifact.get('key') == key
+
+    if uploaded:
+        presigned_url = get_cached_presigned_url(settings, key, expiry_seconds)
+        if presigned_url:
+            return presigned_url
+
+    s3_client = get_settings_s3_client(settings)
+    if not (uploaded and s3_object_matches(s3_client, bucket_name, key, artifact.get('etag'))):
+        with timed('pdf', doctype):
+            pdf_file = generate_pdf_file(doc, doctype, print_format=print_format)
+        with pdf_file, timed('upload', doctype):
+            etag = put_pdf_object(s3_client, bucket_name, key, pdf_file, fingerprint=fingerprint)
+        frappe.cache().set_value(
+            cache_key,
+            {'key': key, 'etag': etag},
+            expires_in_sec=PDF_ARTIFACT_CACHE_TTL
+        )
+
+    with timed('presign', doctype):
+        return get_presigned_pdf_url(settings, key, expiry_seconds, s3_client=s3_client)
+
+
+def get_pdf_fingerprint(doctype, docname, modified, print_format):
+    """Identity of a rendered PDF; changes whenever the document or format does."""
+    raw = f"{doctype}|{docname}|{modified}|{print_format}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def s3_object_matches(s3_client, bucket_name, key, etag):
+    """Return True if `key` exists in the bucket with the given ETag."""
+    if not etag:
+        return False
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=key)
+    except (BotoCoreError, ClientError):
+        return False
+    return head.get('ETag') == etag
+
+
+def get_s3_settings():
+    """Return the validated S3 settings from Whatsapp S3 Configuration.
+
+    Cheap to call: nothing is built and no network call is made.
+    """
     cfg = get_whatsapp_s3_config()
 
     aws_access_key_id = cfg.get('aws_access_key_id')
@@ -377,52 +661,132 @@ def upload_pdf_and_get_presigned_url(doc, doctype, pdf_bytes, expiry_seconds=432
     if not region_name:
         frappe.throw(_("Missing S3 region. Please set Region Name in Whatsapp S3 Configuration."))
 
-    # Create S3 client with explicit region and optional path-style when bucket has dots
-    try:
-        config_kwargs = {}
-        if signature_version:
-            config_kwargs['signature_version'] = signature_version
+    return frappe._dict(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        bucket_name=bucket_name,
+        region_name=region_name,
+        endpoint_url=endpoint_url,
+        signature_version=signature_version,
         # Force path-style if bucket has dots to avoid signature mismatch
-        if '.' in bucket_name:
-            config_kwargs['s3'] = {'addressing_style': 'path'}
-
-        client_config = Config(**config_kwargs) if config_kwargs else None
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name,
-            endpoint_url=endpoint_url,
-            config=client_config
+        addressing_style='path' if '.' in bucket_name else None,
+        max_pool_connections=cfg.get('max_pool_connections'),
+        folder=folder.strip('/') if isinstance(folder, str) else '',
+    )
+
+
+def get_settings_s3_client(settings):
+    """Pooled S3 client with explicit region and optional path-style addressing."""
+    try:
+        return get_s3_client(
+            aws_access_key_id=settings.aws_access_key_id,
+            aws_secret_access_key=settings.aws_secret_access_key,
+            region_name=settings.region_name,
+            endpoint_url=settings.endpoint_url,
+            signature_version=settings.signature_version,
+            addressing_style=settings.addressing_style,
+            max_pool_connections=settings.max_pool_connections
         )
     except (BotoCoreError, ClientError) as e:
         frappe.throw(_("Failed to create S3 client: {0}").format(str(e)))
 
-    # Object key
+
+def get_pdf_object_key(doctype, docname, folder=''):
     safe_doctype = doctype.replace(' ', '_')
-    object_name = f"{safe_doctype}_{doc.name}.pdf"
-    folder_clean = folder.strip('/') if isinstance(folder, str) else ''
-    key = f"{folder_clean}/{object_name}" if folder_clean else object_name
+    object_name = f"{safe_doctype}_{docname}.pdf"
+    return f"{folder}/{object_name}" if folder else object_name
+
 
-    # Upload
+def put_pdf_object(s3_client, bucket_name, key, pdf, fingerprint=None):
+    """Upload a PDF under `key` and return the stored object's ETag.
+
+    `pdf` is either bytes or a binary file object. File objects go through
+    boto3's managed transfer, which switches to a parallel multipart upload
+    above the configured threshold and reads the file one part at a time.
+    """
+    extra_args = {'ContentType': 'application/pdf'}
+    if fingerprint:
+        extra_args['Metadata'] = {'fingerprint': fingerprint}
     try:
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=key,
-            Body=pdf_bytes,
-            ContentType='application/pdf'
+        if isinstance(pdf, bytes | bytearray):
+            response = s3_client.put_object(Bucket=bucket_name, Key=key, Body=pdf, **extra_args)
+            return response.get('ETag')
+
+        s3_client.upload_fileobj(
+            pdf,
+            bucket_name,
+            key,
+            ExtraArgs=extra_args,
+            Config=get_s3_transfer_config()
         )
-    except (BotoCoreError, ClientError) as e:
+        # Managed transfers don't return the response, so read the ETag back
+        return s3_client.head_object(Bucket=bucket_name, Key=key).get('ETag')
+    except (BotoCoreError, ClientError, S3UploadFailedError) as e:
         frappe.throw(_("Failed to upload to S3: {0}").format(str(e)))
 
-    # Presign URL
+
+def get_s3_transfer_config():
+    """Multipart upload settings from Whatsapp S3 Configuration."""
+    cfg = get_whatsapp_s3_config()
+    return get_transfer_config(
+        multipart_threshold=cfg.get('multipart_threshold'),
+        multipart_chunksize=cfg.get('multipart_chunksize'),
+        max_concurrency=cfg.get('multipart_max_concurrency')
+    )
+
+
+def get_presigned_pdf_url(settings, key, expiry_seconds, s3_client=None):
+    """Return a presigned GET URL for `key`, valid for `expiry_seconds`.
+
+    URLs are cached per object key and expiry and handed out again while more
+    than half of their validity remains. The object behind a key is replaced in
+    place, so a cached URL always serves the latest upload.
+    """
+    presigned_url = get_cached_presigned_url(settings, key, expiry_seconds)
+    if presigned_url:
+        return presigned_url
+
+    presigned_url = sign_pdf_url(settings, key, expiry_seconds, s3_client=s3_client)
+    frappe.cache().set_value(
+        get_presigned_url_cache_key(settings, key, expiry_seconds),
+        presigned_url,
+        expires_in_sec=max(1, int(expiry_seconds) // 2)
+    )
+    return presigned_url
+
+
+def get_cached_presigned_url(settings, key, expiry_seconds):
+    return frappe.cache().get_value(get_presigned_url_cache_key(settings, key, expiry_seconds))
+
+
+def get_presigned_url_cache_key(settings, key, expiry_seconds):
+    # The access key is part of the key so rotated credentials never reuse old signatures
+    return (
+        f"{PRESIGNED_URL_CACHE_PREFIX}:{settings.aws_access_key_id}:{settings.bucket_name}"
+        f":{int(expiry_seconds)}:{key}"
+    )
+
+
+def sign_pdf_url(settings, key, expiry_seconds, s3_client=None):
+    """Presign a GET for `key`; SigV4 is signed locally, without an S3 client."""
+    if settings.signature_version == 's3v4':
+        return presign_get_object_url(
+            settings.aws_access_key_id,
+            settings.aws_secret_access_key,
+            settings.region_name,
+            settings.bucket_name,
+            key,
+            expiry_seconds,
+            addressing_style=settings.addressing_style
+        )
+
+    s3_client = s3_client or get_settings_s3_client(settings)
     try:
-        url = s3_client.generate_presigned_url(
+        return s3_client.generate_presigned_url(
             'get_object',
-            Params={'Bucket': bucket_name, 'Key': key},
+            Params={'Bucket': settings.bucket_name, 'Key': key},
             ExpiresIn=int(expiry_seconds)
         )
-        return url
     except (BotoCoreError, ClientError) as e:
         frappe.throw(_("Failed to generate presigned URL: {0}").format(str(e)))
 
@@ -431,8 +795,8 @@ def get_whatsapp_s3_config():
     """Fetch configuration from single doctype `Whatsapp S3 Configuration`.
     Returns a dict of relevant fields.
     """
-    # DocType is Single, so name equals doctype
-    cfg_doc = frappe.get_doc('Whatsapp S3 Configuration')
+    # DocType is Single, so name equals doctype; cached until it is saved again
+    cfg_doc = frappe.get_cached_doc('Whatsapp S3 Configuration')
 
     # Safely extract attributes; fieldnames follow the DocType JSON
     def _get(name, default=None):
@@ -446,6 +810,10 @@ def get_whatsapp_s3_config():
         'folder': _get('folder'),            # optional, may be absent
         'endpoint_url': None,                # let boto3 construct endpoint
         'signature_version': _get('signature_version'),
+        'max_pool_connections': _get('max_pool_connections'),
+        'multipart_threshold': _get('multipart_threshold'),
+        'multipart_chunksize': _get('multipart_chunksize'),
+        'multipart_max_concurrency': _get('multipart_max_concurrency'),
     }
 
 
@@ -454,31 +822,13 @@ def render_whatsapp_message(doctype, docname):
     """Render WhatsApp message from the selected template for a doctype and document.
     Returns the rendered text and a flag indicating HTML usage.
     """
-    doc = frappe.get_doc(doctype, docname)
+    template_doc = get_enabled_template(doctype)
 
-    templates = frappe.get_all('Whatsapp Template',
-        filters={
-            'reference_doctype': doctype,
-            'enabled': 1
-        },
-        limit=1
-    )
-
-    if not templates:
+    if not template_doc:
         frappe.throw(_("No WhatsApp template found for {0}").format(doctype))
 
-    template_doc = frappe.get_doc('Whatsapp Template', templates[0].name)
-
-    try:
-        if template_doc.use_html:
-            jinja_template = Template(template_doc.response_html)
-        else:
-            jinja_template = Template(template_doc.response)
-
-        message = jinja_template.render(doc=doc)
-    except Exception as e:
-        frappe.log_error(f"Template rendering failed: {str(e)}", "WhatsApp Template Render")
-        frappe.throw(_("Failed to render message template: {0}").format(str(e)))
+    doc = get_render_doc(template_doc, doctype, docname, render_only=True)
+    message = render_template_message(template_doc, doc)
 
     return {
         'message': message,
@@ -488,43 +838,39 @@ def render_whatsapp_message(doctype, docname):
 
 @frappe.whitelist()
 def prepare_whatsapp_presigned_message(doctype, docname):
-    """Render template, upload PDF to S3, and return message with a 12h presigned link."""
+    """Render template, upload PDF to S3, and return message with a presigned link.
+
+    Rendering the caption and producing the PDF link (PDF generation, S3
+    upload, signing) are independent. The PDF link is built on a background
+    thread while the caption renders here; its timeout is tunable via
+    `whatsapp_stage_timeouts` in site config.
+    """
     doc = frappe.get_doc(doctype, docname)
 
-    templates = frappe.get_all('Whatsapp Template',
-        filters={
-            'reference_doctype': doctype,
-            'enabled': 1
-        },
-        limit=1
-    )
+    template_doc = get_enabled_template(doctype)
 
-    if not templates:
+    if not template_doc:
         frappe.throw(_("No WhatsApp template found for {0}").format(doctype))
 
-    template_doc = frappe.get_doc('Whatsapp Template', templates[0].name)
-
-    try:
-        if template_doc.use_html:
-            jinja_template = Template(template_doc.response_html)
-        else:
-            jinja_template = Template(template_doc.response)
-
-        caption = jinja_template.render(doc=doc)
-    except Exception as e:
-        frappe.log_error(f"Template rendering failed: {str(e)}", "WhatsApp Template Render")
-        frappe.throw(_("Failed to render message template: {0}").format(str(e)))
-
-    pdf_bytes = generate_pdf_bytes(doc, doctype)
-
     try:
-        s3_url = upload_pdf_and_get_presigned_url(doc, doctype, pdf_bytes, expiry_seconds=7 * 24 * 60 * 60)
-    except Exception as e:
-        err = str(e)
+        stages = run_stages(
+            {
+                'pdf': (
+                    lambda: get_document_pdf_url(doc, doctype, expiry_seconds=PRESIGNED_LINK_EXPIRY),
+                    get_stage_timeout('pdf', PDF_STAGE_TIMEOUT),
+                ),
+            },
+            foreground={'render': lambda: render_template_message(template_doc, doc)},
+        )
+    except StageError as e:
+        if e.stage != 'pdf':
+            raise e.error
+        err = str(e.error)
         frappe.log_error(message=err, title="WhatsApp S3 Upload")
         frappe.throw(_("Failed to upload to S3 or create presigned URL: {0}").format(err))
 
-    link_notice = _("This link will expire in 7 days.")
+    caption, s3_url = stages['render'], stages['pdf']
+    link_notice = _("This link is valid for at least {0} days.").format(PRESIGNED_LINK_EXPIRY // 2 // 86400)
     message_with_link = f"{caption}\n\n{_('Download PDF')}: {s3_url}\n{link_notice}"
 
     return {
@@ -0,0 +1,240 @@
+import queue
+import threading
+import time
+
+import frappe
+from frappe import _
+
+from whatsapp_integration.api.api import deliver_whatsapp_message
+from whatsapp_integration.api.contacts import resolve_whatsapp_recipients
+from whatsapp_integration.api.gateway import close_gateway_sessions
+from whatsapp_integration.api.message_log import insert_message_logs
+from whatsapp_integration.api.phone import normalize_many
+from whatsapp_integration.api.templates import get_enabled_template, get_render_doc
+
+# Parallel render/PDF/upload/send pipelines per bulk job; `whatsapp_bulk_workers` in site config
+DEFAULT_BULK_WORKERS = 4
+MAX_BULK_WORKERS = 16
+
+# Realtime events pushed to the user who started the bulk send
+BULK_PROGRESS_EVENT = 'whatsapp_bulk_progress'
+BULK_COMPLETE_EVENT = 'whatsapp_bulk_complete'
+
+
+@frappe.whitelist()
+def send_whatsapp_bulk(doctype, docnames):
+    """Queue WhatsApp messages for many documents of one doctype.
+
+    Each document goes to its primary WhatsApp-enabled contact. Documents the
+    user can't read are left out. Returns a `bulk_id`; progress and the final
+    per-document report are pushed to the caller over realtime.
+    """
+    docnames = frappe.parse_json(docnames) if isinstance(docnames, str) else docnames
+    docnames = list(dict.fromkeys(docnames or []))
+    if not docnames:
+        frappe.throw(_("Select at least one document to send"))
+
+    frappe.has_permission(doctype, 'read', throw=True)
+
+    if not get_enabled_template(doctype):
+        frappe.throw(_("No WhatsApp template found for {0}").format(doctype))
+
+    # One query applying user permissions and sharing, not a check per document
+    permitted = set(frappe.get_list(doctype, filters={'name': ['in', docnames]}, pluck='name', limit=len(docnames)))
+    not_permitted = [docname for docname in docnames if docname not in permitted]
+    docnames = [docname for docname in docnames if docname in permitted]
+    if not docnames:
+        frappe.throw(_("You do not have access to the selected documents"), frappe.PermissionError)
+
+    bulk_id = frappe.generate_hash(length=12)
+    frappe.enqueue(
+        'whatsapp_integration.api.bulk.run_bulk_send',
+        queue='long',
+        timeout=max(1500, len(docnames) * 30),
+        doctype=doctype,
+        docnames=docnames,
+        bulk_id=bulk_id,
+    )
+
+    return {'bulk_id': bulk_id, 'total': len(docnames), 'not_permitted': not_permitted}
+
+
+def run_bulk_send(doctype, docnames, bulk_id=None):
+    """Background job: send to all documents through a bounded worker pool."""
+    started = time.monotonic()
+    user = frappe.session.user
+
+    template_doc = get_enabled_template(doctype)
+    if not template_doc:
+        frappe.throw(_("No WhatsApp template found for {0}").format(doctype))
+
+    recipients = resolve_bulk_recipients(doctype, docnames)
+
+    # Validate every number up front with one default-country lookup
+    phones = dict(zip(
+        recipients,
+        normalize_many(recipient['phone'] for recipient in recipients.values()),
+        strict=True,
+    ))
+
+    results = []
+    tasks = []
+    for docname in docnames:
+        recipient = recipients.get(docname)
+        if not recipient:
+            results.append({
+                'docname': docname,
+                'status': 'Skipped',
+                'error': _("No WhatsApp-enabled contact found"),
+            })
+            continue
+
+        phone, error = phones[docname]
+        if error:
+            results.append({
+                'docname': docname,
+                'phone': recipient['phone'],
+                'contact_name': recipient['contact_display'],
+                'status': 'Failed',
+                'error': error,
+            })
+        else:
+            tasks.append((docname, dict(recipient, phone=phone)))
+
+    def on_progress(done):
+        frappe.publish_realtime(
+            BULK_PROGRESS_EVENT,
+            {'bulk_id': bulk_id, 'doctype': doctype, 'done': done + len(results), 'total': len(docnames)},
+            user=user,
+        )
+
+    # Log rows of all sends, written in one insert when the pool is done
+    message_log = []
+    try:
+        results.extend(run_in_worker_pool(
+            tasks,
+            lambda docname, recipient: send_bulk_document(
+                doctype, docname, recipient, template_doc, message_log
+            ),
+            max_workers=get_bulk_workers(),
+            on_progress=on_progress,
+        ))
+    finally:
+        insert_message_logs(message_log)
+        frappe.db.commit()
+
+    elapsed = time.monotonic() - started
+    sent = sum(1 for r in results if r['status'] == 'Sent')
+    summary = {
+        'bulk_id': bulk_id,
+        'doctype': doctype,
+        'total': len(docnames),
+        'sent': sent,
+        'failed': sum(1 for r in results if r['status'] == 'Failed'),
+        'skipped': sum(1 for r in results if r['status'] == 'Skipped'),
+        'elapsed': round(elapsed, 2),
+        'throughput': round(sent / elapsed, 2) if elapsed else 0,
+        'results': results,
+    }
+    frappe.publish_realtime(BULK_COMPLETE_EVENT, summary, user=user)
+    return summary
+
+
+def resolve_bulk_recipients(doctype, docnames):
+    """Return `{docname: contact}` with the first (primary) WhatsApp number per document."""
+    recipients = resolve_whatsapp_recipients((doctype, docname) for docname in docnames)
+    return {docname: contacts[0] for (_doctype, docname), contacts in recipients.items()}
+
+
+def send_bulk_document(doctype, docname, recipient, template_doc, message_log=None):
+    """Send one document inside a worker thread and report the outcome."""
+    started = time.monotonic()
+    result = {
+        'docname': docname,
+        'phone': recipient['phone'],
+        'contact_name': recipient['contact_display'],
+    }
+    try:
+        doc = get_render_doc(template_doc, doctype, docname)
+        deliver_whatsapp_message(
+            doc, template_doc, recipient['phone'], recipient['contact_display'], message_log=message_log
+        )
+        frappe.db.commit()
+        result['status'] = 'Sent'
+    except Exception as e:
+        # Roll back first: the Error Log rows written on the way out would go with it
+        traceback = frappe.get_traceback()
+        frappe.db.rollback()
+        frappe.log_error(
+            title="WhatsApp Bulk Send", message=traceback, reference_doctype=doctype, reference_name=docname
+        )
+        frappe.db.commit()
+        result.update(status='Failed', error=str(e))
+
+    result['duration'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def get_bulk_workers():
+    workers = frappe.conf.get('whatsapp_bulk_workers') or DEFAULT_BULK_WORKERS
+    return max(1, min(int(workers), MAX_BULK_WORKERS))
+
+
+def run_in_worker_pool(tasks, fn, max_workers, on_progress=None, progress_every=10):
+    """Run `fn(*task)` for every task on at most `max_workers` threads.
+
+    Each thread opens its own site connection as the current user, so `fn`
+    can use the ORM freely. The first item of a task names it in the failure
+    result if `fn` raises. Returns the results in completion order.
+    """
+    if not tasks:
+        return []
+
+    site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+    pending = queue.Queue()
+    for task in tasks:
+        pending.put(task)
+    done = queue.Queue()
+
+    def worker():
+        try:
+            frappe.init(site=site, sites_path=sites_path)
+            frappe.connect()
+            frappe.set_user(user)
+            setup_error = None
+        except Exception as e:
+            setup_error = e
+
+        try:
+            while True:
+                try:
+                    task = pending.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if setup_error:
+                        raise setup_error
+                    done.put(fn(*task))
+                except Exception as e:
+                    done.put({'docname': task[0], 'status': 'Failed', 'error': str(e)})
+        finally:
+            # The thread ends here; its connections stay pooled for the rest of the process
+            close_gateway_sessions()
+            frappe.destroy()
+
+    threads = [
+        threading.Thread(target=worker, daemon=True)
+        for _i in range(min(max_workers, len(tasks)))
+    ]
+    for thread in threads:
+        thread.start()
+
+    results = []
+    for count in range(1, len(tasks) + 1):
+        results.append(done.get())
+        if on_progress and (count % progress_every == 0 or count == len(tasks)):
+            on_progress(count)
+
+    for thread in threads:
+        thread.join()
+    return results
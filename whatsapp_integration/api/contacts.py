@@ -0,0 +1,206 @@
+import frappe
+from frappe import _
+from frappe.query_builder import Criterion, Order
+
+# Party link fields tried on a doctype, in order, with the party doctype they point to.
+# Dynamic Links (e.g. Quotation.party_name) take the party doctype from their options field.
+DEFAULT_PARTY_FIELDS = (
+    ('customer', 'Customer'),
+    ('party_name', 'Customer'),
+    ('supplier', 'Supplier'),
+    ('lead', 'Lead'),
+    ('employee', 'Employee'),
+)
+
+# Parties per grouped contact query; keeps the IN lists at a sane size
+PARTY_QUERY_BATCH_SIZE = 1000
+
+
+def get_party_field(doctype):
+    """Return how `doctype` links to its party, or None.
+
+    The result has `fieldname`, `party_doctype` and, for Dynamic Links,
+    `party_doctype_field`. Per-doctype overrides come from the
+    `whatsapp_party_fields` site config, e.g.
+    `{"Purchase Order": {"fieldname": "supplier", "party_doctype": "Supplier"}}`.
+    """
+    override = (frappe.conf.get('whatsapp_party_fields') or {}).get(doctype)
+    if override:
+        if isinstance(override, str):
+            override = {'fieldname': override}
+        return _resolve_party_field(doctype, override['fieldname'], override.get('party_doctype'))
+
+    meta = frappe.get_meta(doctype)
+    for fieldname, party_doctype in DEFAULT_PARTY_FIELDS:
+        if meta.has_field(fieldname):
+            return _resolve_party_field(doctype, fieldname, party_doctype)
+    return None
+
+
+def _resolve_party_field(doctype, fieldname, party_doctype=None):
+    field = frappe.get_meta(doctype).get_field(fieldname)
+    party_doctype_field = None
+    if field and field.fieldtype == 'Dynamic Link':
+        party_doctype_field = field.options
+    elif field and field.fieldtype == 'Link' and not party_doctype:
+        party_doctype = field.options
+
+    return frappe._dict(
+        fieldname=fieldname,
+        party_doctype=party_doctype,
+        party_doctype_field=party_doctype_field,
+    )
+
+
+def get_document_parties(doctype, docnames):
+    """Return `{docname: (party_doctype, party)}` reading only the party columns."""
+    party_field = get_party_field(doctype)
+    if not party_field:
+        frappe.throw(_("No customer field found in {0}").format(doctype))
+
+    fields = ['name', party_field.fieldname]
+    if party_field.party_doctype_field:
+        fields.append(party_field.party_doctype_field)
+
+    parties = {}
+    for row in frappe.get_all(doctype, filters={'name': ['in', list(docnames)]}, fields=fields):
+        party = row.get(party_field.fieldname)
+        if not party:
+            continue
+        party_doctype = party_field.party_doctype
+        if party_field.party_doctype_field:
+            party_doctype = row.get(party_field.party_doctype_field) or party_doctype
+        parties[row.name] = (party_doctype, party)
+    return parties
+
+
+def resolve_whatsapp_recipients(documents):
+    """Resolve WhatsApp-enabled contacts for many documents, possibly of several doctypes.
+
+    `documents` is an iterable of `(doctype, docname)`. Reads the party column
+    with one query per doctype, then all parties' numbers in one grouped query.
+    Returns `{(doctype, docname): [contact, ...]}` with primary numbers first;
+    documents without any WhatsApp number are left out.
+    """
+    docnames_by_doctype = {}
+    for doctype, docname in documents:
+        docnames_by_doctype.setdefault(doctype, set()).add(docname)
+
+    document_parties = {}
+    for doctype, docnames in docnames_by_doctype.items():
+        for docname, party in get_document_parties(doctype, docnames).items():
+            document_parties[(doctype, docname)] = party
+
+    numbers = get_whatsapp_numbers_for_parties(document_parties.values())
+    return {
+        document: numbers[party]
+        for document, party in document_parties.items()
+        if numbers.get(party)
+    }
+
+
+@frappe.whitelist()
+def get_whatsapp_contacts_batch(documents):
+    """Whitelisted batch variant of `get_whatsapp_contacts`.
+
+    `documents` is a list of `[doctype, docname]` pairs (or dicts with those
+    keys). Returns `{doctype: {docname: [contact, ...]}}`.
+    """
+    documents = frappe.parse_json(documents) if isinstance(documents, str) else documents
+    pairs = [
+        (d['doctype'], d['docname']) if isinstance(d, dict) else tuple(d)
+        for d in documents or []
+    ]
+    for doctype in {doctype for doctype, _docname in pairs}:
+        frappe.has_permission(doctype, 'read', throw=True)
+
+    result = {}
+    for (doctype, docname), contacts in resolve_whatsapp_recipients(pairs).items():
+        result.setdefault(doctype, {})[docname] = contacts
+    return result
+
+
+def get_whatsapp_numbers_for_parties(parties):
+    """Return `{(party_doctype, party_name): [contact, ...]}` of WhatsApp-enabled numbers.
+
+    Resolves all parties, across party doctypes, in one joined query over
+    Dynamic Link, Contact and Contact Phone per batch. Each contact dict has
+    the same shape as the one returned by `get_whatsapp_contacts`, and primary
+    mobile numbers come first.
+    """
+    names_by_doctype = {}
+    for party_doctype, name in parties:
+        if party_doctype and name:
+            names_by_doctype.setdefault(party_doctype, set()).add(name)
+
+    numbers = {}
+    seen = set()
+    for batch in _batch_parties(names_by_doctype):
+        for row in _query_whatsapp_numbers(batch):
+            # A contact linked twice to the same party would otherwise repeat its numbers
+            key = (row.party_doctype, row.party, row.contact_name, row.phone)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            contact_display = row.first_name or row.contact_name
+            if row.last_name:
+                contact_display += ' ' + row.last_name
+
+            numbers.setdefault((row.party_doctype, row.party), []).append({
+                'contact_name': row.contact_name,
+                'contact_display': contact_display,
+                'phone': row.phone,
+                'is_primary': row.is_primary_mobile_no or False
+            })
+    return numbers
+
+
+def _batch_parties(names_by_doctype):
+    batch, size = {}, 0
+    for party_doctype, names in names_by_doctype.items():
+        for name in names:
+            batch.setdefault(party_doctype, []).append(name)
+            size += 1
+            if size >= PARTY_QUERY_BATCH_SIZE:
+                yield batch
+                batch, size = {}, 0
+    if batch:
+        yield batch
+
+
+def _query_whatsapp_numbers(names_by_doctype):
+    DynamicLink = frappe.qb.DocType('Dynamic Link')
+    Contact = frappe.qb.DocType('Contact')
+    ContactPhone = frappe.qb.DocType('Contact Phone')
+
+    party_filter = Criterion.any([
+        (DynamicLink.link_doctype == party_doctype) & DynamicLink.link_name.isin(names)
+        for party_doctype, names in names_by_doctype.items()
+    ])
+
+    return (
+        frappe.qb.from_(DynamicLink)
+        .join(Contact).on(Contact.name == DynamicLink.parent)
+        .join(ContactPhone).on(
+            (ContactPhone.parent == Contact.name) & (ContactPhone.parenttype == 'Contact')
+        )
+        .select(
+            DynamicLink.link_doctype.as_('party_doctype'),
+            DynamicLink.link_name.as_('party'),
+            Contact.name.as_('contact_name'),
+            Contact.first_name,
+            Contact.last_name,
+            ContactPhone.phone,
+            ContactPhone.is_primary_mobile_no,
+        )
+        .where(DynamicLink.parenttype == 'Contact')
+        .where(party_filter)
+        .where(ContactPhone.custom_is_whatsapp_enabled == 1)
+        .where(ContactPhone.phone.notnull())
+        .where(ContactPhone.phone != '')
+        .orderby(ContactPhone.is_primary_mobile_no, order=Order.desc)
+        .orderby(Contact.name)
+        .orderby(ContactPhone.idx)
+        .run(as_dict=True)
+    )
@@ -0,0 +1,91 @@
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+# Seconds a message waits for later sends to the same document and phone;
+# `whatsapp_dispatch_window` in site config. 0 (the default) enqueues every
+# message right away; a window makes sends wait for the scheduler, so they
+# don't go out while it is disabled
+DEFAULT_DISPATCH_WINDOW = 0
+# A burst that keeps re-arming the window is flushed after this many seconds anyway
+DEFAULT_DISPATCH_MAX_DELAY = 10 * 60
+
+# Messages handed to one background job, and the most looked at per scheduler run
+DISPATCH_BATCH_SIZE = 50
+MAX_DISPATCH_ROWS = 5000
+
+# Batch jobs are killed after this many seconds; a message still Queued this
+# long after it was dispatched lost its job and is dispatched again
+DISPATCH_JOB_TIMEOUT = 25 * 60
+REDISPATCH_AFTER = DISPATCH_JOB_TIMEOUT + 5 * 60
+
+PROCESS_OUTBOX_BATCH = (
+    'whatsapp_integration.whatsapp_integration.doctype.whatsapp_outbox.whatsapp_outbox.process_outbox_batch'
+)
+
+
+def get_dispatch_window():
+    return int(frappe.conf.get('whatsapp_dispatch_window', DEFAULT_DISPATCH_WINDOW) or 0)
+
+
+def dispatch_outbox():
+    """Scheduler job: coalesce queued messages and flush them in batches.
+
+    Queued messages are grouped by (document, phone). A group is ready once
+    its newest message is older than the dispatch window, or its oldest has
+    waited longer than `whatsapp_dispatch_max_delay`. Only the newest message
+    of a ready group is sent (it renders the document as it is now); the
+    others are marked Coalesced and point at it.
+
+    Messages still Queued `REDISPATCH_AFTER` seconds after being handed to a
+    job (the job was lost or its worker died) are dispatched again, including
+    those enqueued directly when there is no window.
+    """
+    window = get_dispatch_window()
+
+    now = now_datetime()
+    ready_before = add_to_date(now, seconds=-window)
+    overdue_before = add_to_date(
+        now, seconds=-int(frappe.conf.get('whatsapp_dispatch_max_delay') or DEFAULT_DISPATCH_MAX_DELAY)
+    )
+
+    groups = {}
+    for row in frappe.get_all(
+        'Whatsapp Outbox',
+        filters={'status': 'Queued'},
+        or_filters=[
+            ['dispatched_on', 'is', 'not set'],
+            ['dispatched_on', '<', add_to_date(now, seconds=-REDISPATCH_AFTER)],
+        ],
+        fields=['name', 'reference_doctype', 'reference_name', 'phone', 'creation'],
+        order_by='creation asc',
+        limit=MAX_DISPATCH_ROWS,
+    ):
+        groups.setdefault((row.reference_doctype, row.reference_name, row.phone), []).append(row)
+
+    to_send = []
+    for rows in groups.values():
+        latest = rows[-1]
+        if latest.creation > ready_before and rows[0].creation > overdue_before:
+            continue
+        to_send.append(latest.name)
+        for row in rows[:-1]:
+            frappe.get_doc('Whatsapp Outbox', row.name).update_status('Coalesced', coalesced_into=latest.name)
+
+    if not to_send:
+        return
+
+    # Claimed before enqueueing, so the next run does not pick them up again
+    Outbox = frappe.qb.DocType('Whatsapp Outbox')
+    frappe.qb.update(Outbox).set(Outbox.dispatched_on, now).where(Outbox.name.isin(to_send)).run()
+    frappe.db.commit()
+
+    for start in range(0, len(to_send), DISPATCH_BATCH_SIZE):
+        batch = to_send[start:start + DISPATCH_BATCH_SIZE]
+        frappe.enqueue(
+            PROCESS_OUTBOX_BATCH,
+            queue='long',
+            timeout=DISPATCH_JOB_TIMEOUT,
+            job_id=f"whatsapp_outbox_batch::{batch[0]}",
+            deduplicate=True,
+            outbox_names=batch,
+        )
@@ -0,0 +1,283 @@
+import os
+import random
+import threading
+import time
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+# Defaults, overridable from site config
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+# Sends per second across all workers of the site, and how many may go out at once
+DEFAULT_RATE_LIMIT = 5
+DEFAULT_BURST = 10
+# Longest a send waits for a token before giving up
+MAX_THROTTLE_WAIT = 60
+
+# Retries with full-jitter exponential backoff
+DEFAULT_MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+# Only answers that say the request was not processed; `POST /sendText` is not
+# idempotent, so a 500/502/504 may already have sent the message
+RETRY_STATUSES = (429, 503)
+
+# Consecutive failures that open the circuit, and seconds before a probe is let through
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30
+
+RATE_LIMIT_CACHE_KEY = 'whatsapp_gateway_bucket'
+CIRCUIT_CACHE_KEY = 'whatsapp_gateway_circuit'
+
+# KEYS[1] bucket; ARGV rate, burst. Takes a token and returns 0, or returns the
+# seconds to wait for one. Uses the redis clock so all workers agree on time.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# KEYS[1] circuit; ARGV cooldown. Returns 1 when closed, 2 for a half-open probe
+# (one per cooldown) and 0 while open.
+CIRCUIT_ALLOW_SCRIPT = """
+local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until') or '0')
+if open_until == 0 then
+    return 1
+end
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+if now < open_until then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'open_until', tostring(now + tonumber(ARGV[1])))
+return 2
+"""
+
+# KEYS[1] circuit; ARGV ok, threshold, cooldown. Resets on success, opens the
+# circuit once failures reach the threshold.
+CIRCUIT_RECORD_SCRIPT = """
+if ARGV[1] == '1' then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local cooldown = tonumber(ARGV[3])
+if failures >= tonumber(ARGV[2]) then
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    redis.call('HSET', KEYS[1], 'open_until', tostring(now + cooldown))
+end
+redis.call('EXPIRE', KEYS[1], cooldown * 10)
+return failures
+"""
+
+
+class GatewayUnavailable(requests.exceptions.ConnectionError):
+    """The circuit is open: the gateway failed repeatedly and is not being called."""
+
+
+class GatewayThrottled(requests.exceptions.RequestException):
+    """No send token became available within `MAX_THROTTLE_WAIT`."""
+
+# Each thread keeps its own sessions, so no Session (and its cookies) is ever
+# shared across threads; their connection pools are shared, see `get_gateway_adapter`
+_local = threading.local()
+
+# (base_url, pool size) -> HTTPAdapter shared by all threads of this process
+_adapters = {}
+_adapters_pid = None
+_adapters_lock = threading.Lock()
+
+
+def get_gateway_session(base_url):
+    """Return this thread's keep-alive session for the WhatsApp gateway at `base_url`.
+
+    Sessions of all threads mount one adapter per process, so consecutive sends
+    from any worker or bulk-send thread reuse a warm TCP/TLS connection, and at
+    most `whatsapp_gateway_pool_size` (site config) idle connections are kept.
+    """
+    pool_size = get_gateway_pool_size()
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+
+    key = (base_url, pool_size)
+    session = sessions.get(key)
+    if session is None:
+        session = requests.Session()
+        adapter = get_gateway_adapter(base_url, pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        sessions[key] = session
+    return session
+
+
+def get_gateway_adapter(base_url, pool_size):
+    """Return this process's connection pool for `base_url`, creating it after a fork.
+
+    urllib3 pools are thread-safe; threads beyond `pool_size` sending at once
+    open extra connections that are closed once used instead of kept.
+    """
+    global _adapters_pid
+
+    with _adapters_lock:
+        if _adapters_pid != os.getpid():
+            # Connections inherited from the parent process must not be reused
+            _adapters.clear()
+            _adapters_pid = os.getpid()
+        key = (base_url, pool_size)
+        if key not in _adapters:
+            _adapters[key] = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        return _adapters[key]
+
+
+def get_gateway_pool_size():
+    return int(frappe.conf.get('whatsapp_gateway_pool_size') or DEFAULT_POOL_SIZE)
+
+
+def get_gateway_timeout():
+    """Return the `(connect, read)` timeout used for gateway calls.
+
+    Set `whatsapp_gateway_connect_timeout` / `whatsapp_gateway_read_timeout`
+    in site config to tune them.
+    """
+    connect = frappe.conf.get('whatsapp_gateway_connect_timeout') or DEFAULT_CONNECT_TIMEOUT
+    read = frappe.conf.get('whatsapp_gateway_read_timeout') or DEFAULT_READ_TIMEOUT
+    return (float(connect), float(read))
+
+
+def close_gateway_sessions():
+    """Drop this thread's gateway sessions.
+
+    Their connections belong to the process-wide pool and stay there for other
+    threads, so the sessions are not closed.
+    """
+    sessions = getattr(_local, 'sessions', None) or {}
+    sessions.clear()
+
+
+def post_to_gateway(base_url, path, payload):
+    """POST `payload` to the gateway with rate limiting, retries and a circuit breaker.
+
+    Every attempt first takes a token from a bucket shared by all workers of
+    the site (`whatsapp_gateway_rate_limit` per second, `whatsapp_gateway_burst`
+    at once; a rate of 0 disables it). 429/503 answers and failures to connect
+    are retried up to `whatsapp_gateway_max_retries` times with jittered
+    exponential backoff. After `whatsapp_gateway_breaker_threshold` consecutive
+    failures the circuit opens and calls fail fast with `GatewayUnavailable`
+    until a probe gets through after `whatsapp_gateway_breaker_cooldown`
+    seconds. Other errors, read timeouts and dropped connections are not
+    retried, as the message may have gone out.
+    """
+    max_retries = int(frappe.conf.get('whatsapp_gateway_max_retries') or DEFAULT_MAX_RETRIES)
+    url = f"{base_url}{path}"
+
+    attempt = 0
+    while True:
+        check_circuit(base_url)
+        acquire_send_token()
+
+        response = None
+        try:
+            response = get_gateway_session(base_url).post(url, json=payload, timeout=get_gateway_timeout())
+        except requests.exceptions.RequestException as e:
+            record_gateway_result(base_url, ok=False)
+            if not is_connect_error(e):
+                raise
+            error = e
+        else:
+            # 429 means the gateway is up, just busy; only errors count against the circuit
+            record_gateway_result(base_url, ok=response.status_code < 500)
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response
+            error = requests.exceptions.HTTPError(
+                f"{response.status_code} Error for url: {url}", response=response
+            )
+
+        if attempt >= max_retries:
+            raise error
+        time.sleep(get_backoff_delay(attempt, response))
+        attempt += 1
+
+
+def is_connect_error(error):
+    """True if `error` happened before the request was sent: refused, DNS or connect timeout."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or isinstance(error, GatewayUnavailable):
+        return False
+    # requests wraps urllib3's MaxRetryError; NewConnectionError and name
+    # resolution failures are ConnectTimeoutError subclasses
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def get_backoff_delay(attempt, response=None):
+    """Full-jitter exponential backoff, honouring a numeric Retry-After header."""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_CAP)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def acquire_send_token():
+    """Block until the site-wide token bucket hands out a send slot."""
+    rate = float(frappe.conf.get('whatsapp_gateway_rate_limit', DEFAULT_RATE_LIMIT) or 0)
+    if rate <= 0:
+        return
+    burst = max(1, int(frappe.conf.get('whatsapp_gateway_burst') or DEFAULT_BURST))
+
+    cache = frappe.cache()
+    take_token = cache.register_script(TOKEN_BUCKET_SCRIPT)
+    key = cache.make_key(RATE_LIMIT_CACHE_KEY)
+    deadline = time.monotonic() + MAX_THROTTLE_WAIT
+    while True:
+        wait = float(take_token(keys=[key], args=[rate, burst]))
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise GatewayThrottled("WhatsApp gateway rate limit: no send slot available")
+        time.sleep(wait)
+
+
+def check_circuit(base_url):
+    """Raise `GatewayUnavailable` while the circuit for `base_url` is open."""
+    cache = frappe.cache()
+    allow = cache.register_script(CIRCUIT_ALLOW_SCRIPT)
+    if not int(allow(keys=[get_circuit_key(base_url)], args=[get_breaker_cooldown()])):
+        raise GatewayUnavailable(f"WhatsApp gateway at {base_url} is unavailable; retrying shortly")
+
+
+def record_gateway_result(base_url, ok):
+    cache = frappe.cache()
+    record = cache.register_script(CIRCUIT_RECORD_SCRIPT)
+    threshold = int(frappe.conf.get('whatsapp_gateway_breaker_threshold') or DEFAULT_BREAKER_THRESHOLD)
+    record(keys=[get_circuit_key(base_url)], args=[1 if ok else 0, threshold, get_breaker_cooldown()])
+
+
+def get_circuit_key(base_url):
+    return frappe.cache().make_key(f"{CIRCUIT_CACHE_KEY}:{base_url}")
+
+
+def get_breaker_cooldown():
+    return int(frappe.conf.get('whatsapp_gateway_breaker_cooldown') or DEFAULT_BREAKER_COOLDOWN)
@@ -0,0 +1,154 @@
+import html
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+# Bumped whenever the conversion output changes, so precompiled templates are rebuilt
+MARKUP_VERSION = 2
+
+HTML_TAG = re.compile(r'</?[a-zA-Z][^>]*>')
+# Jinja expressions, statements and comments are kept out of the HTML parser
+JINJA_BLOCK = re.compile(r'\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}', re.DOTALL)
+# Private-use characters can't occur in templates, so they delimit the placeholders
+PLACEHOLDER = re.compile('\ue000(\\d+)\ue001')
+
+INLINE_MARKERS = {
+    'b': '*', 'strong': '*',
+    'i': '_', 'em': '_',
+    's': '~', 'strike': '~', 'del': '~',
+    'code': '```',
+}
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'header', 'footer', 'blockquote', 'table', 'tr'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+SKIPPED_TAGS = {'script', 'style', 'head', 'title'}
+
+
+def is_html(text):
+    return bool(text and HTML_TAG.search(text))
+
+
+def to_whatsapp_markup(text):
+    """Return `text` as WhatsApp markup if it is HTML, else unchanged."""
+    return html_to_whatsapp(text) if is_html(text) else (text or '')
+
+
+@lru_cache(maxsize=256)
+def html_to_whatsapp(source):
+    """Convert HTML to WhatsApp markup: *bold*, _italic_, ~strike~, line breaks and lists.
+
+    Jinja tags pass through untouched (only their HTML entities are decoded),
+    so a template can be converted once and then rendered per recipient.
+    Results are memoized per process.
+    """
+    jinja_blocks = []
+
+    def protect(match):
+        jinja_blocks.append(html.unescape(match.group(0)))
+        return f"\ue000{len(jinja_blocks) - 1}\ue001"
+
+    converter = WhatsAppMarkupConverter()
+    converter.feed(JINJA_BLOCK.sub(protect, source or ''))
+    converter.close()
+
+    return PLACEHOLDER.sub(lambda m: jinja_blocks[int(m.group(1))], converter.get_text())
+
+
+class WhatsAppMarkupConverter(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        # Open inline format tags as (tag, index into parts where it started)
+        self.inline = []
+        # Open lists as [ordered, next item number]
+        self.lists = []
+        self.links = []
+        self.skip = 0
+        self.pre = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip += 1
+        elif tag == 'br':
+            self.parts.append('\n')
+        elif tag in BLOCK_TAGS or tag in HEADING_TAGS:
+            self.newline()
+            if tag in HEADING_TAGS:
+                self.inline.append((tag, len(self.parts)))
+        elif tag in INLINE_MARKERS:
+            self.inline.append((tag, len(self.parts)))
+        elif tag == 'pre':
+            self.newline()
+            self.pre += 1
+            self.inline.append((tag, len(self.parts)))
+        elif tag in ('ul', 'ol'):
+            self.newline()
+            self.lists.append([tag == 'ol', 1])
+        elif tag == 'li':
+            self.newline()
+            indent = '  ' * max(0, len(self.lists) - 1)
+            if self.lists and self.lists[-1][0]:
+                bullet = f"{self.lists[-1][1]}. "
+                self.lists[-1][1] += 1
+            else:
+                bullet = '• '
+            self.parts.append(indent + bullet)
+        elif tag == 'a':
+            self.links.append((dict(attrs).get('href'), len(self.parts)))
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip = max(0, self.skip - 1)
+        elif tag in INLINE_MARKERS or tag in HEADING_TAGS or tag == 'pre':
+            marker = '```' if tag == 'pre' else INLINE_MARKERS.get(tag, '*')
+            self.close_inline(tag, marker)
+            if tag == 'pre':
+                self.pre = max(0, self.pre - 1)
+            if tag in HEADING_TAGS or tag == 'pre':
+                self.newline()
+        elif tag in BLOCK_TAGS or tag == 'li':
+            self.newline()
+        elif tag in ('ul', 'ol'):
+            if self.lists:
+                self.lists.pop()
+            self.newline()
+        elif tag == 'a' and self.links:
+            href, start = self.links.pop()
+            label = ''.join(self.parts[start:]).strip()
+            if href and href not in label and not href.startswith(('#', 'javascript:')):
+                self.parts.append(f" ({href})" if label else href)
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if not self.pre:
+            data = re.sub(r'\s+', ' ', data)
+            # Leading space at the start of a line is not visible in HTML either
+            if data.startswith(' ') and (not self.parts or self.parts[-1].endswith('\n')):
+                data = data[1:]
+        self.parts.append(data)
+
+    def close_inline(self, tag, marker):
+        for i in range(len(self.inline) - 1, -1, -1):
+            if self.inline[i][0] == tag:
+                _tag, start = self.inline.pop(i)
+                break
+        else:
+            return
+
+        text = ''.join(self.parts[start:])
+        inner = text.strip()
+        if inner:
+            # WhatsApp only formats when the markers hug the text
+            lead = text[:len(text) - len(text.lstrip())]
+            trail = text[len(text.rstrip()):]
+            text = f"{lead}{marker}{inner}{marker}{trail}"
+        self.parts[start:] = [text]
+
+    def newline(self):
+        if self.parts and not self.parts[-1].endswith('\n'):
+            self.parts.append('\n')
+
+    def get_text(self):
+        text = ''.join(self.parts)
+        text = '\n'.join(line.rstrip() for line in text.split('\n'))
+        return re.sub(r'\n{3,}', '\n\n', text).strip()
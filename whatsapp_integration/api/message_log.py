@@ -0,0 +1,95 @@
+import frappe
+from frappe import _
+from frappe.utils import escape_html, get_fullname, now_datetime
+
+MESSAGE_LOG_DOCTYPE = 'Whatsapp Message Log'
+MESSAGE_LOG_FIELDS = (
+    'name', 'creation', 'modified', 'owner', 'modified_by',
+    'reference_doctype', 'reference_name', 'whatsapp_template', 'outbox',
+    'phone', 'contact_name', 'with_attachment',
+)
+
+# Most recent sends shown in a document's timeline
+TIMELINE_LOG_LIMIT = 100
+
+# Cached doctypes that have a Whatsapp Template, enabled or not; only these can have logs
+LOGGED_DOCTYPES_CACHE_KEY = 'whatsapp_message_log_doctypes'
+
+
+def make_message_log(doc, template_doc, phone, contact_name=None, outbox=None, sender=None):
+    """Return the Whatsapp Message Log row for a sent message, ready for `insert_message_logs`.
+
+    `sender` owns the row and is named in the timeline; defaults to the session user.
+    """
+    now = now_datetime()
+    user = sender or frappe.session.user
+    return {
+        'name': frappe.generate_hash(length=10),
+        'creation': now,
+        'modified': now,
+        'owner': user,
+        'modified_by': user,
+        'reference_doctype': doc.doctype,
+        'reference_name': doc.name,
+        'whatsapp_template': template_doc.name,
+        'outbox': outbox,
+        'phone': phone,
+        'contact_name': contact_name,
+        'with_attachment': 1 if template_doc.send_attachment else 0,
+    }
+
+
+def insert_message_logs(entries):
+    """Write message log rows with one multi-row INSERT, skipping the ORM and its hooks."""
+    if not entries:
+        return
+    frappe.db.bulk_insert(
+        MESSAGE_LOG_DOCTYPE,
+        MESSAGE_LOG_FIELDS,
+        [tuple(entry[field] for field in MESSAGE_LOG_FIELDS) for entry in entries],
+    )
+
+
+def get_timeline_content(doctype, docname):
+    """`additional_timeline_content` hook: the document's sends as timeline items.
+
+    Runs on every form load, so doctypes without a template return without a query.
+    """
+    if doctype not in get_logged_doctypes():
+        return []
+
+    logs = frappe.get_all(
+        MESSAGE_LOG_DOCTYPE,
+        filters={'reference_doctype': doctype, 'reference_name': docname},
+        fields=['creation', 'owner', 'phone', 'contact_name', 'with_attachment'],
+        order_by='creation desc',
+        limit=TIMELINE_LOG_LIMIT,
+    )
+
+    items = []
+    for log in logs:
+        if log.with_attachment:
+            message = _("{0} sent a WhatsApp message with the PDF to {1}")
+        else:
+            message = _("{0} sent a WhatsApp message to {1}")
+        items.append({
+            'creation': log.creation,
+            'content': message.format(
+                escape_html(get_fullname(log.owner)),
+                escape_html(log.contact_name or log.phone),
+            ),
+        })
+    return items
+
+
+def get_logged_doctypes():
+    return frappe.cache().get_value(LOGGED_DOCTYPES_CACHE_KEY, generator=_load_logged_doctypes)
+
+
+def _load_logged_doctypes():
+    return sorted(set(frappe.get_all('Whatsapp Template', pluck='reference_doctype')))
+
+
+def clear_logged_doctypes_cache(doc=None, method=None, *args, **kwargs):
+    """doc_events handler for Whatsapp Template changes."""
+    frappe.cache().delete_value(LOGGED_DOCTYPES_CACHE_KEY)
@@ -0,0 +1,94 @@
+import time
+from contextlib import contextmanager
+
+import frappe
+from werkzeug.wrappers import Response
+
+# All series live in one redis hash, one field per counter
+METRICS_CACHE_KEY = 'whatsapp_metrics'
+METRIC_NAME = 'whatsapp_stage_duration_seconds'
+
+# Histogram upper bounds in seconds; +Inf is implied
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+@contextmanager
+def timed(stage, doctype=None):
+    """Time the enclosed block as `stage`; outcome is `error` if it raises."""
+    started = time.perf_counter()
+    outcome = 'success'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, doctype=doctype, outcome=outcome)
+
+
+def observe(stage, seconds, doctype=None, outcome='success'):
+    """Record one observation: a count, the running sum and one histogram bucket.
+
+    Buckets are stored non-cumulatively and summed on export, so each
+    observation is three increments in a single round trip. Failures to
+    record are ignored; metrics never break a send.
+    """
+    labels = f"{stage}|{doctype or ''}|{outcome}"
+    bucket = next((str(bound) for bound in DURATION_BUCKETS if seconds <= bound), '+Inf')
+    try:
+        cache = frappe.cache()
+        key = cache.make_key(METRICS_CACHE_KEY)
+        pipe = cache.pipeline(transaction=False)
+        pipe.hincrby(key, f"count|{labels}", 1)
+        pipe.hincrbyfloat(key, f"sum|{labels}", seconds)
+        pipe.hincrby(key, f"bucket|{labels}|{bucket}", 1)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def get_metric_series():
+    """Return `{(stage, doctype, outcome): {'count', 'sum', 'buckets'}}` from redis."""
+    cache = frappe.cache()
+    raw = cache.execute_command('HGETALL', cache.make_key(METRICS_CACHE_KEY)) or {}
+
+    series = {}
+    for field, value in raw.items():
+        kind, stage, doctype, outcome, *bound = frappe.safe_decode(field).split('|')
+        entry = series.setdefault((stage, doctype, outcome), {'count': 0, 'sum': 0.0, 'buckets': {}})
+        value = frappe.safe_decode(value)
+        if kind == 'count':
+            entry['count'] = int(value)
+        elif kind == 'sum':
+            entry['sum'] = float(value)
+        elif kind == 'bucket':
+            entry['buckets'][bound[0]] = int(value)
+    return series
+
+
+def render_prometheus():
+    """Render all series as a Prometheus text-format histogram."""
+    lines = [
+        f"# HELP {METRIC_NAME} Time spent per WhatsApp send stage.",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    for (stage, doctype, outcome), entry in sorted(get_metric_series().items()):
+        labels = f'stage="{_escape(stage)}",doctype="{_escape(doctype)}",outcome="{_escape(outcome)}"'
+        cumulative = 0
+        for bound in [str(b) for b in DURATION_BUCKETS] + ['+Inf']:
+            cumulative += entry['buckets'].get(bound, 0)
+            lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{METRIC_NAME}_sum{{{labels}}} {entry['sum']}")
+        lines.append(f"{METRIC_NAME}_count{{{labels}}} {entry['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@frappe.whitelist()
+def get_metrics():
+    """Prometheus scrape endpoint for WhatsApp send stage latencies."""
+    frappe.only_for('System Manager')
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,368 @@
+import frappe
+from frappe import _
+
+# ITU-T E.164 country calling codes. Codes form a prefix code, so at most one
+# of them can match the start of a number.
+COUNTRY_CALLING_CODES = (
+    ('1', ('United States', 'Canada', 'Puerto Rico', 'Jamaica', 'Trinidad and Tobago', 'Bahamas', 'Barbados')),
+    ('7', ('Russia', 'Russian Federation', 'Kazakhstan')),
+    ('20', ('Egypt',)),
+    ('211', ('South Sudan',)),
+    ('212', ('Morocco',)),
+    ('213', ('Algeria',)),
+    ('216', ('Tunisia',)),
+    ('218', ('Libya',)),
+    ('220', ('Gambia',)),
+    ('221', ('Senegal',)),
+    ('222', ('Mauritania',)),
+    ('223', ('Mali',)),
+    ('224', ('Guinea',)),
+    ('225', ("Côte d'Ivoire", 'Ivory Coast')),
+    ('226', ('Burkina Faso',)),
+    ('227', ('Niger',)),
+    ('228', ('Togo',)),
+    ('229', ('Benin',)),
+    ('230', ('Mauritius',)),
+    ('231', ('Liberia',)),
+    ('232', ('Sierra Leone',)),
+    ('233', ('Ghana',)),
+    ('234', ('Nigeria',)),
+    ('235', ('Chad',)),
+    ('236', ('Central African Republic',)),
+    ('237', ('Cameroon',)),
+    ('238', ('Cape Verde', 'Cabo Verde')),
+    ('239', ('Sao Tome and Principe',)),
+    ('240', ('Equatorial Guinea',)),
+    ('241', ('Gabon',)),
+    ('242', ('Congo',)),
+    ('243', ('Congo, The Democratic Republic of the', 'Democratic Republic of the Congo')),
+    ('244', ('Angola',)),
+    ('245', ('Guinea-Bissau',)),
+    ('246', ('British Indian Ocean Territory',)),
+    ('247', ('Ascension Island',)),
+    ('248', ('Seychelles',)),
+    ('249', ('Sudan',)),
+    ('250', ('Rwanda',)),
+    ('251', ('Ethiopia',)),
+    ('252', ('Somalia',)),
+    ('253', ('Djibouti',)),
+    ('254', ('Kenya',)),
+    ('255', ('Tanzania',)),
+    ('256', ('Uganda',)),
+    ('257', ('Burundi',)),
+    ('258', ('Mozambique',)),
+    ('260', ('Zambia',)),
+    ('261', ('Madagascar',)),
+    ('262', ('Réunion', 'Reunion', 'Mayotte')),
+    ('263', ('Zimbabwe',)),
+    ('264', ('Namibia',)),
+    ('265', ('Malawi',)),
+    ('266', ('Lesotho',)),
+    ('267', ('Botswana',)),
+    ('268', ('Eswatini', 'Swaziland')),
+    ('269', ('Comoros',)),
+    ('27', ('South Africa',)),
+    ('290', ('Saint Helena',)),
+    ('291', ('Eritrea',)),
+    ('297', ('Aruba',)),
+    ('298', ('Faroe Islands',)),
+    ('299', ('Greenland',)),
+    ('30', ('Greece',)),
+    ('31', ('Netherlands',)),
+    ('32', ('Belgium',)),
+    ('33', ('France',)),
+    ('34', ('Spain',)),
+    ('350', ('Gibraltar',)),
+    ('351', ('Portugal',)),
+    ('352', ('Luxembourg',)),
+    ('353', ('Ireland',)),
+    ('354', ('Iceland',)),
+    ('355', ('Albania',)),
+    ('356', ('Malta',)),
+    ('357', ('Cyprus',)),
+    ('358', ('Finland',)),
+    ('359', ('Bulgaria',)),
+    ('36', ('Hungary',)),
+    ('370', ('Lithuania',)),
+    ('371', ('Latvia',)),
+    ('372', ('Estonia',)),
+    ('373', ('Moldova', 'Moldova, Republic of')),
+    ('374', ('Armenia',)),
+    ('375', ('Belarus',)),
+    ('376', ('Andorra',)),
+    ('377', ('Monaco',)),
+    ('378', ('San Marino',)),
+    ('379', ('Holy See (Vatican City State)', 'Vatican City')),
+    ('380', ('Ukraine',)),
+    ('381', ('Serbia',)),
+    ('382', ('Montenegro',)),
+    ('383', ('Kosovo',)),
+    ('385', ('Croatia',)),
+    ('386', ('Slovenia',)),
+    ('387', ('Bosnia and Herzegovina',)),
+    ('389', ('North Macedonia', 'Macedonia')),
+    ('39', ('Italy',)),
+    ('40', ('Romania',)),
+    ('41', ('Switzerland',)),
+    ('420', ('Czech Republic', 'Czechia')),
+    ('421', ('Slovakia',)),
+    ('423', ('Liechtenstein',)),
+    ('43', ('Austria',)),
+    ('44', ('United Kingdom',)),
+    ('45', ('Denmark',)),
+    ('46', ('Sweden',)),
+    ('47', ('Norway',)),
+    ('48', ('Poland',)),
+    ('49', ('Germany',)),
+    ('500', ('Falkland Islands (Malvinas)', 'Falkland Islands')),
+    ('501', ('Belize',)),
+    ('502', ('Guatemala',)),
+    ('503', ('El Salvador',)),
+    ('504', ('Honduras',)),
+    ('505', ('Nicaragua',)),
+    ('506', ('Costa Rica',)),
+    ('507', ('Panama',)),
+    ('508', ('Saint Pierre and Miquelon',)),
+    ('509', ('Haiti',)),
+    ('51', ('Peru',)),
+    ('52', ('Mexico',)),
+    ('53', ('Cuba',)),
+    ('54', ('Argentina',)),
+    ('55', ('Brazil',)),
+    ('56', ('Chile',)),
+    ('57', ('Colombia',)),
+    ('58', ('Venezuela', 'Venezuela, Bolivarian Republic of')),
+    ('590', ('Guadeloupe',)),
+    ('591', ('Bolivia', 'Bolivia, Plurinational State of')),
+    ('592', ('Guyana',)),
+    ('593', ('Ecuador',)),
+    ('594', ('French Guiana',)),
+    ('595', ('Paraguay',)),
+    ('596', ('Martinique',)),
+    ('597', ('Suriname',)),
+    ('598', ('Uruguay',)),
+    ('599', ('Curaçao', 'Curacao')),
+    ('60', ('Malaysia',)),
+    ('61', ('Australia',)),
+    ('62', ('Indonesia',)),
+    ('63', ('Philippines',)),
+    ('64', ('New Zealand',)),
+    ('65', ('Singapore',)),
+    ('66', ('Thailand',)),
+    ('670', ('Timor-Leste',)),
+    ('672', ('Norfolk Island',)),
+    ('673', ('Brunei Darussalam', 'Brunei')),
+    ('674', ('Nauru',)),
+    ('675', ('Papua New Guinea',)),
+    ('676', ('Tonga',)),
+    ('677', ('Solomon Islands',)),
+    ('678', ('Vanuatu',)),
+    ('679', ('Fiji',)),
+    ('680', ('Palau',)),
+    ('681', ('Wallis and Futuna',)),
+    ('682', ('Cook Islands',)),
+    ('683', ('Niue',)),
+    ('685', ('Samoa',)),
+    ('686', ('Kiribati',)),
+    ('687', ('New Caledonia',)),
+    ('688', ('Tuvalu',)),
+    ('689', ('French Polynesia',)),
+    ('690', ('Tokelau',)),
+    ('691', ('Micronesia', 'Micronesia, Federated States of')),
+    ('692', ('Marshall Islands',)),
+    ('81', ('Japan',)),
+    ('82', ('South Korea', 'Korea, Republic of')),
+    ('84', ('Vietnam', 'Viet Nam')),
+    ('850', ('North Korea', "Korea, Democratic Peoples Republic of")),
+    ('852', ('Hong Kong',)),
+    ('853', ('Macao', 'Macau')),
+    ('855', ('Cambodia',)),
+    ('856', ("Lao People's Democratic Republic", 'Laos')),
+    ('86', ('China',)),
+    ('880', ('Bangladesh',)),
+    ('886', ('Taiwan',)),
+    ('90', ('Turkey', 'Türkiye')),
+    ('91', ('India',)),
+    ('92', ('Pakistan',)),
+    ('93', ('Afghanistan',)),
+    ('94', ('Sri Lanka',)),
+    ('95', ('Myanmar',)),
+    ('960', ('Maldives',)),
+    ('961', ('Lebanon',)),
+    ('962', ('Jordan',)),
+    ('963', ('Syria', 'Syrian Arab Republic')),
+    ('964', ('Iraq',)),
+    ('965', ('Kuwait',)),
+    ('966', ('Saudi Arabia',)),
+    ('967', ('Yemen',)),
+    ('968', ('Oman',)),
+    ('970', ('Palestine', 'Palestinian Territory, Occupied')),
+    ('971', ('United Arab Emirates',)),
+    ('972', ('Israel',)),
+    ('973', ('Bahrain',)),
+    ('974', ('Qatar',)),
+    ('975', ('Bhutan',)),
+    ('976', ('Mongolia',)),
+    ('977', ('Nepal',)),
+    ('98', ('Iran', 'Iran, Islamic Republic of')),
+    ('992', ('Tajikistan',)),
+    ('993', ('Turkmenistan',)),
+    ('994', ('Azerbaijan',)),
+    ('995', ('Georgia',)),
+    ('996', ('Kyrgyzstan',)),
+    ('998', ('Uzbekistan',)),
+)
+
+# Used when System Settings has no (known) country
+FALLBACK_CALLING_CODE = '91'
+
+DEFAULT_CALLING_CODE_CACHE_KEY = 'whatsapp_default_calling_code'
+
+# Digits of a subscriber number written without country code
+NATIONAL_NUMBER_LENGTH = 10
+MIN_PHONE_LENGTH = 10
+MAX_PHONE_LENGTH = 15
+
+# A number only "has" a country code if more than this many digits follow it
+MIN_DIGITS_AFTER_CODE = 8
+
+_TERMINAL = None
+
+
+def _build_trie(codes):
+    trie = {}
+    for code in codes:
+        node = trie
+        for digit in code:
+            node = node.setdefault(digit, {})
+        node[_TERMINAL] = code
+    return trie
+
+
+CALLING_CODE_TRIE = _build_trie(code for code, _countries in COUNTRY_CALLING_CODES)
+CALLING_CODE_BY_COUNTRY = {
+    country: code
+    for code, countries in COUNTRY_CALLING_CODES
+    for country in countries
+}
+
+_DIGITS = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isdigit()))
+
+
+class PhoneNumberError(ValueError):
+    pass
+
+
+def match_calling_code(digits):
+    """Return the country calling code `digits` starts with, or None."""
+    node = CALLING_CODE_TRIE
+    for digit in digits[:3]:
+        node = node.get(digit)
+        if node is None:
+            return None
+        if _TERMINAL in node:
+            return node[_TERMINAL]
+    return None
+
+
+def get_calling_code(country):
+    """Return the calling code (without `+`) for a Frappe Country name, or None."""
+    if not country:
+        return None
+    code = CALLING_CODE_BY_COUNTRY.get(country)
+    if code:
+        return code
+
+    # Fall back to Frappe's own country data for names missing above
+    try:
+        from frappe.geo.country_info import get_country_info
+
+        isd = (get_country_info(country) or {}).get('isd')
+    except Exception:
+        isd = None
+    return isd.lstrip('+').replace('-', '') if isd else None
+
+
+def get_default_calling_code():
+    """Calling code of the System Settings country, cached until System Settings is saved."""
+    return frappe.cache().get_value(DEFAULT_CALLING_CODE_CACHE_KEY, generator=_load_default_calling_code)
+
+
+def _load_default_calling_code():
+    country = frappe.db.get_single_value('System Settings', 'country')
+    return get_calling_code(country) or FALLBACK_CALLING_CODE
+
+
+def clear_default_calling_code(doc=None, method=None, *args, **kwargs):
+    """doc_events handler for System Settings."""
+    frappe.cache().delete_value(DEFAULT_CALLING_CODE_CACHE_KEY)
+
+
+def normalize(phone, default_code=None):
+    """Return `phone` as E.164 digits without `+`, raising PhoneNumberError if invalid.
+
+    - Strip everything but digits
+    - A leading `+` or `00` international prefix means the country code is
+      present, whatever the length of the national number (`+65 9123 4567`)
+    - Otherwise add `default_code` (System Settings country) to 10-digit
+      national numbers, also when written with a leading trunk `0`
+    """
+    if not phone:
+        raise PhoneNumberError(_("Phone number is required"))
+
+    phone = str(phone).strip()
+    digits = phone.translate(_DIGITS)
+    if not digits.isdigit():
+        # Non-ASCII digits and symbols
+        digits = ''.join(filter(str.isdigit, digits))
+
+    if not digits:
+        raise PhoneNumberError(_("Invalid phone number format"))
+
+    international = phone.lstrip('(').startswith('+') or digits.startswith('00')
+    if digits.startswith('00'):
+        digits = digits[2:]
+
+    code = match_calling_code(digits)
+    if international:
+        if code is None:
+            raise PhoneNumberError(_("Unknown country calling code in phone number {0}").format(phone))
+        has_country_code = True
+    else:
+        # A bare national number never counts as prefixed, even if it starts like
+        # a code (Indian mobiles starting with 7 vs. Russia's +7)
+        has_country_code = (
+            code is not None
+            and len(digits) > NATIONAL_NUMBER_LENGTH
+            and len(digits) > len(code) + MIN_DIGITS_AFTER_CODE
+        )
+
+    if not has_country_code:
+        if len(digits) == NATIONAL_NUMBER_LENGTH + 1 and digits.startswith('0'):
+            digits = digits[1:]
+        if len(digits) == NATIONAL_NUMBER_LENGTH:
+            digits = (default_code or get_default_calling_code()) + digits
+        elif len(digits) < NATIONAL_NUMBER_LENGTH:
+            raise PhoneNumberError(_("Phone number is too short. Please provide a valid phone number with country code."))
+
+    if len(digits) < MIN_PHONE_LENGTH or len(digits) > MAX_PHONE_LENGTH:
+        raise PhoneNumberError(_("Invalid phone number length. Phone number should be between 10-15 digits including country code."))
+
+    return digits
+
+
+def normalize_many(phones, default_code=None):
+    """Normalize many numbers with a single default-country lookup.
+
+    Returns a list of `(normalized, error)` tuples in input order; exactly one
+    of the two is None for each number.
+    """
+    default_code = default_code or get_default_calling_code()
+    results = []
+    append = results.append
+    for phone in phones:
+        try:
+            append((normalize(phone, default_code), None))
+        except PhoneNumberError as e:
+            append((None, str(e)))
+    return results
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import frappe
+from frappe import _
+
+# Threads per worker process for background stages; `whatsapp_stage_workers` in site config
+DEFAULT_STAGE_WORKERS = 4
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+class StageError(Exception):
+    """A stage of `run_stages` failed or timed out; `error` is the cause."""
+
+    def __init__(self, stage, error):
+        super().__init__(str(error))
+        self.stage = stage
+        self.error = error
+
+
+def run_stages(background, foreground=None):
+    """Run `background` stages on worker threads while `foreground` runs here, and return `{name: result}`.
+
+    `background` maps a stage name to `(fn, timeout)`. Each such stage opens
+    its own site connection as the current user, so it is only worth it for
+    slow work; every stage gets `timeout` seconds from the start of the call.
+    `foreground` maps names to functions run in order on the calling thread
+    meanwhile. The first stage to fail or overrun raises `StageError`.
+
+    Background stages share a small per-process pool. A stage that times out
+    is cancelled if it has not started yet. One that is already running can't
+    be interrupted: it finishes in the background and then releases its
+    connection, but it keeps its pool thread busy until then, so overrunning
+    stages never pile up beyond `whatsapp_stage_workers` per process.
+    """
+    site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+
+    def run(fn):
+        frappe.init(site=site, sites_path=sites_path)
+        try:
+            frappe.connect()
+            frappe.set_user(user)
+            return fn()
+        finally:
+            frappe.destroy()
+
+    started = time.monotonic()
+    executor = get_stage_executor()
+    futures = {name: executor.submit(run, fn) for name, (fn, _timeout) in background.items()}
+    try:
+        results = {}
+        for name, fn in (foreground or {}).items():
+            try:
+                results[name] = fn()
+            except Exception as e:
+                raise StageError(name, e) from e
+
+        for name, (_fn, timeout) in background.items():
+            remaining = max(0, started + timeout - time.monotonic())
+            try:
+                results[name] = futures[name].result(timeout=remaining)
+            except FutureTimeoutError:
+                message = _("WhatsApp {0} did not finish within {1} seconds").format(name, timeout)
+                raise StageError(name, frappe.ValidationError(message))
+            except Exception as e:
+                raise StageError(name, e) from e
+        return results
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+def get_stage_executor():
+    """Return this process's background stage pool, creating it after a fork."""
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            workers = int(frappe.conf.get('whatsapp_stage_workers') or DEFAULT_STAGE_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='whatsapp-stage')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def get_stage_timeout(stage, default):
+    """Seconds allowed for `stage`; `whatsapp_stage_timeouts` in site config overrides."""
+    timeouts = frappe.conf.get('whatsapp_stage_timeouts') or {}
+    return float(timeouts.get(stage) or default)
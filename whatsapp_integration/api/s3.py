@@ -0,0 +1,172 @@
+import hashlib
+import hmac
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import boto3
+import frappe
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+# botocore's own default; raise it for workers running many uploads in parallel
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+# Managed (multipart) upload tuning, overridable from Whatsapp S3 Configuration
+MB = 1024 * 1024
+DEFAULT_MULTIPART_THRESHOLD_MB = 8
+DEFAULT_MULTIPART_CHUNKSIZE_MB = 8
+DEFAULT_MULTIPART_CONCURRENCY = 4
+# S3 rejects non-final parts smaller than 5 MB
+MIN_MULTIPART_CHUNKSIZE_MB = 5
+
+# SigV4 caps presigned URL validity at 7 days
+MAX_PRESIGN_EXPIRY = 7 * 24 * 60 * 60
+# Bucket names botocore would address virtual-hosted style
+DNS_COMPATIBLE_BUCKET = re.compile(r'^[a-z0-9][a-z0-9-]{1,61}[a-z0-9]$')
+
+# (site, settings hash) -> boto3 S3 client, shared by all threads of a worker
+_client_pool = {}
+_client_pool_lock = threading.Lock()
+
+
+def get_s3_client(aws_access_key_id, aws_secret_access_key, region_name,
+                  endpoint_url=None, signature_version=None, addressing_style=None,
+                  max_pool_connections=None):
+    """Return a pooled S3 client for the current site and these settings.
+
+    Clients (and their keep-alive HTTP connections) are reused across requests
+    and background jobs in the same process. A client is rebuilt as soon as the
+    settings hash changes, e.g. after Whatsapp S3 Configuration is saved.
+    """
+    settings = {
+        'aws_access_key_id': aws_access_key_id,
+        'aws_secret_access_key': aws_secret_access_key,
+        'region_name': region_name,
+        'endpoint_url': endpoint_url,
+        'signature_version': signature_version,
+        'addressing_style': addressing_style,
+        'max_pool_connections': int(max_pool_connections or DEFAULT_MAX_POOL_CONNECTIONS),
+    }
+    config_hash = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+    site = getattr(frappe.local, 'site', None)
+    pool_key = (site, config_hash)
+
+    client = _client_pool.get(pool_key)
+    if client is not None:
+        return client
+
+    with _client_pool_lock:
+        client = _client_pool.get(pool_key)
+        if client is None:
+            client = _build_s3_client(settings)
+            # Settings for this site changed; drop clients built from the old ones
+            for key in [k for k in _client_pool if k[0] == site]:
+                del _client_pool[key]
+            _client_pool[pool_key] = client
+        return client
+
+
+def _build_s3_client(settings):
+    config_kwargs = {'max_pool_connections': settings['max_pool_connections']}
+    if settings['signature_version']:
+        config_kwargs['signature_version'] = settings['signature_version']
+    if settings['addressing_style']:
+        config_kwargs['s3'] = {'addressing_style': settings['addressing_style']}
+
+    # boto3.client() shares the default session, which is not thread-safe
+    session = boto3.session.Session()
+    return session.client(
+        's3',
+        aws_access_key_id=settings['aws_access_key_id'],
+        aws_secret_access_key=settings['aws_secret_access_key'],
+        region_name=settings['region_name'],
+        endpoint_url=settings['endpoint_url'],
+        config=Config(**config_kwargs)
+    )
+
+
+def clear_s3_client_pool(doc=None, method=None, *args, **kwargs):
+    """Drop pooled clients of the current site (doc_events handler)."""
+    site = getattr(frappe.local, 'site', None)
+    with _client_pool_lock:
+        for key in [k for k in _client_pool if k[0] == site]:
+            del _client_pool[key]
+
+
+def get_transfer_config(multipart_threshold=None, multipart_chunksize=None, max_concurrency=None):
+    """Return a boto3 `TransferConfig` for streaming uploads; sizes are in MB.
+
+    Files above the threshold are sent as a multipart upload read part by
+    part, so memory stays around `chunksize * max_concurrency` whatever the
+    file size.
+    """
+    threshold = int(multipart_threshold or DEFAULT_MULTIPART_THRESHOLD_MB)
+    chunksize = max(int(multipart_chunksize or DEFAULT_MULTIPART_CHUNKSIZE_MB), MIN_MULTIPART_CHUNKSIZE_MB)
+    concurrency = max(1, int(max_concurrency or DEFAULT_MULTIPART_CONCURRENCY))
+    return TransferConfig(
+        multipart_threshold=threshold * MB,
+        multipart_chunksize=chunksize * MB,
+        max_concurrency=concurrency,
+        use_threads=concurrency > 1,
+    )
+
+
+def presign_get_object_url(aws_access_key_id, aws_secret_access_key, region_name,
+                           bucket_name, key, expiry_seconds, addressing_style=None, now=None):
+    """Return a SigV4 presigned GET URL for `key`, computed locally.
+
+    Produces the same kind of URL as `generate_presigned_url('get_object')` on
+    a client with the regional endpoint, but with only hashing and no client,
+    credentials resolver or endpoint machinery behind it.
+    """
+    regional_host = f"s3.{region_name}.amazonaws.com"
+    if addressing_style == 'path' or not DNS_COMPATIBLE_BUCKET.match(bucket_name):
+        host, path = regional_host, f"/{bucket_name}/{key}"
+    else:
+        host, path = f"{bucket_name}.{regional_host}", f"/{key}"
+
+    return presign_get_url(
+        host, path, aws_access_key_id, aws_secret_access_key, region_name, expiry_seconds, now=now
+    )
+
+
+def presign_get_url(host, path, aws_access_key_id, aws_secret_access_key, region_name,
+                    expiry_seconds, now=None):
+    """Return `https://{host}{path}` with a SigV4 query-string signature for S3 GET requests."""
+    expiry_seconds = max(1, min(int(expiry_seconds), MAX_PRESIGN_EXPIRY))
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    datestamp = amz_date[:8]
+    canonical_uri = quote(path, safe='/-_.~')
+
+    scope = f"{datestamp}/{region_name}/s3/aws4_request"
+    params = {
+        'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+        'X-Amz-Credential': f"{aws_access_key_id}/{scope}",
+        'X-Amz-Date': amz_date,
+        'X-Amz-Expires': str(expiry_seconds),
+        'X-Amz-SignedHeaders': 'host',
+    }
+    canonical_query = '&'.join(
+        f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}"
+        for name, value in sorted(params.items())
+    )
+    canonical_request = '\n'.join([
+        'GET', canonical_uri, canonical_query, f"host:{host}", '', 'host', 'UNSIGNED-PAYLOAD',
+    ])
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+    ])
+
+    signing_key = ('AWS4' + aws_secret_access_key).encode('utf-8')
+    for part in (datestamp, region_name, 's3', 'aws4_request'):
+        signing_key = hmac.new(signing_key, part.encode('utf-8'), hashlib.sha256).digest()
+    signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    return f"https://{host}{canonical_uri}?{canonical_query}&X-Amz-Signature={signature}"
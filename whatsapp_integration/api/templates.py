@@ -0,0 +1,394 @@
+import hashlib
+import hmac
+import json
+import threading
+from collections import OrderedDict
+
+import frappe
+import jinja2
+from frappe.model import default_fields
+from frappe.model.document import Document
+from frappe.utils.password import get_encryption_key
+from jinja2 import nodes
+from jinja2.sandbox import SandboxedEnvironment
+
+from whatsapp_integration.api.markup import MARKUP_VERSION, is_html, to_whatsapp_markup
+
+# Upper bound on compiled templates kept per worker process
+COMPILED_TEMPLATE_CACHE_SIZE = 128
+
+
+def finalize_value(value):
+    """Jinja `finalize`: output HTML field values (Text Editor, `address_display`) as WhatsApp markup."""
+    return to_whatsapp_markup(value) if isinstance(value, str) and is_html(value) else value
+
+
+# Templates are user-editable, so they are parsed and rendered in Jinja's sandbox.
+# The static HTML of a template is converted once before compiling; values
+# printed into it are converted as they are output
+template_environment = SandboxedEnvironment(finalize=finalize_value)
+
+# Redis hash mapping reference_doctype -> enabled template payload
+TEMPLATE_RESOLVER_CACHE_KEY = 'whatsapp_template_by_doctype'
+
+# Cached list of doctypes with an enabled template, shipped in the boot payload
+TEMPLATE_DOCTYPES_CACHE_KEY = 'whatsapp_template_doctypes'
+
+# Realtime event broadcasting that list whenever a template changes
+TEMPLATE_DOCTYPES_EVENT = 'whatsapp_template_doctypes'
+
+# Columns needed to render and send; everything else stays in the DB
+TEMPLATE_PAYLOAD_FIELDS = [
+    'name', 'modified', 'reference_doctype', 'use_html',
+    'response', 'response_html', 'send_attachment', 'referenced_fields',
+    'compiled_template',
+]
+
+
+class CompiledTemplateCache:
+    """Thread-safe LRU cache of compiled Jinja templates.
+
+    Entries are keyed by site, Whatsapp Template name, its `modified`
+    timestamp and the source field in use, so a saved template never serves
+    a stale compile even in worker processes that did not see the save, and
+    sites of a bench never share one.
+    """
+
+    def __init__(self, maxsize=COMPILED_TEMPLATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, source, compiled=None):
+        """Return the template for `key`, building it from `compiled` code when usable."""
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+
+        # Compile outside the lock; a concurrent miss on the same key just
+        # compiles twice and the last writer wins
+        template = load_compiled_template(source, compiled) or template_environment.from_string(
+            to_whatsapp_markup(source)
+        )
+
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return template
+
+    def invalidate(self, name=None):
+        """Drop this site's entries for template `name`, or everything when no name is given."""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                return
+            site = getattr(frappe.local, 'site', None)
+            for key in [k for k in self._entries if k[:2] == (site, name)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+compiled_template_cache = CompiledTemplateCache()
+
+
+def get_compiled_template(template_doc):
+    """Return the compiled Jinja template for a Whatsapp Template.
+
+    HTML templates (Text Editor or `use_html`) are converted to WhatsApp
+    markup before compiling, so rendering yields gateway-ready text and no
+    HTML is parsed per recipient. Uses the code precompiled when the template
+    was saved, so workers skip Jinja's lexer and parser.
+    """
+    field = 'response_html' if template_doc.use_html else 'response'
+    key = (getattr(frappe.local, 'site', None), template_doc.name, str(template_doc.modified), field)
+    return compiled_template_cache.get(key, template_doc.get(field), template_doc.get('compiled_template'))
+
+
+def compile_template_source(source):
+    """Compile `source` to Python code in the sandbox, for storing with the template.
+
+    The header ties the code to its source, Jinja and markup converter
+    versions, and signs it with the site's encryption key. Code that doesn't
+    match is ignored and the source compiled again.
+    """
+    code = template_environment.compile(to_whatsapp_markup(source), raw=True)
+    header = _get_compiled_header(source)
+    return f"{header} sig {_sign_compiled_code(header, code)}\n{code}"
+
+
+def load_compiled_template(source, compiled):
+    """Build a template from stored compiled code, or None if it is missing, stale or unsigned.
+
+    The code runs as plain Python outside the sandbox, so only code signed by
+    `compile_template_source` on this site is trusted; a `compiled_template`
+    written any other way (e.g. `frappe.db.set_value`) is never executed.
+    """
+    expected = _get_compiled_header(source)
+    header, _newline, code = (compiled or '').partition('\n')
+    signature = header.removeprefix(f"{expected} sig ")
+    if not code or signature == header or not hmac.compare_digest(
+        signature, _sign_compiled_code(expected, code)
+    ):
+        return None
+
+    code = compile(compiled, '<whatsapp template>', 'exec')
+    return template_environment.template_class.from_code(
+        template_environment, code, template_environment.make_globals(None)
+    )
+
+
+def _get_compiled_header(source):
+    digest = hashlib.sha1((source or '').encode('utf-8')).hexdigest()
+    return f"# whatsapp template source {digest} jinja {jinja2.__version__} markup {MARKUP_VERSION}"
+
+
+def _sign_compiled_code(header, code):
+    message = f"{header}\n{code}".encode()
+    return hmac.new(get_encryption_key().encode(), message, hashlib.sha256).hexdigest()
+
+
+def clear_compiled_template_cache(name=None):
+    compiled_template_cache.invalidate(name)
+
+
+def get_compiled_template_cache_stats():
+    return compiled_template_cache.stats()
+
+
+def get_enabled_template(doctype):
+    """Return the enabled Whatsapp Template payload for `doctype`, or None.
+
+    Served from the site cache; the DB is only read on the first lookup after
+    a template is saved, renamed or deleted.
+    """
+    payload = frappe.cache().hget(
+        TEMPLATE_RESOLVER_CACHE_KEY, doctype,
+        generator=lambda: _load_enabled_template(doctype)
+    )
+    # An empty dict is cached for doctypes without a template
+    return frappe._dict(payload) if payload else None
+
+
+def _load_enabled_template(doctype):
+    templates = frappe.get_all('Whatsapp Template',
+        filters={
+            'reference_doctype': doctype,
+            'enabled': 1
+        },
+        fields=TEMPLATE_PAYLOAD_FIELDS,
+        order_by='modified desc',
+        limit=1
+    )
+    return dict(templates[0]) if templates else {}
+
+
+def clear_template_resolver_cache(doc=None, method=None, *args, **kwargs):
+    """doc_events handler for Whatsapp Template changes."""
+    frappe.cache().delete_value(TEMPLATE_RESOLVER_CACHE_KEY)
+
+
+def get_template_doctypes():
+    """Return the sorted doctypes that have an enabled Whatsapp Template."""
+    return frappe.cache().get_value(TEMPLATE_DOCTYPES_CACHE_KEY, generator=_load_template_doctypes)
+
+
+def _load_template_doctypes():
+    return sorted(set(frappe.get_all('Whatsapp Template',
+        filters={'enabled': 1},
+        pluck='reference_doctype'
+    )))
+
+
+def publish_template_doctypes(doc=None, method=None, *args, **kwargs):
+    """doc_events handler: refresh the doctype list and push it to all desk sessions."""
+    frappe.cache().delete_value(TEMPLATE_DOCTYPES_CACHE_KEY)
+    frappe.publish_realtime(
+        TEMPLATE_DOCTYPES_EVENT,
+        {'doctypes': _load_template_doctypes()},
+        after_commit=True
+    )
+
+
+def get_template_field_projection(source, reference_doctype):
+    """Work out which columns of `reference_doctype` a template reads.
+
+    Returns `{'fields': [...], 'tables': {table_field: [child fields]}}`, where
+    a table is only listed if the template uses it. Only the columns read
+    through a `{% for row in doc.<table> %}` variable are fetched; any other
+    use of the table, e.g. `doc.items[0]`, fetches every column (listed as
+    None). Returns None when `doc` is used in a way a projection can't
+    serve, e.g. passed around whole or through Document methods such as
+    `doc.get_formatted`; such templates are rendered from the full document.
+    Raises `jinja2.TemplateSyntaxError` for invalid templates.
+    """
+    fields, tables = set(), {}
+
+    for row_meta, table, attribute in _iter_field_references(source, reference_doctype):
+        if table is None:
+            if attribute is None or not _is_projectable_field(row_meta, attribute):
+                return None
+            if _is_table_field(row_meta, attribute):
+                tables.setdefault(attribute, set())
+            else:
+                fields.add(attribute)
+        elif attribute is None:
+            # The row is used whole, e.g. `{{ item }}`; fetch every column
+            tables[table] = None
+        elif not _is_projectable_field(row_meta, attribute) or _is_table_field(row_meta, attribute):
+            return None
+        elif tables.setdefault(table, set()) is not None:
+            tables[table].add(attribute)
+
+    return {
+        'fields': sorted(fields | {'name'}),
+        'tables': {
+            table: sorted(child_fields) if child_fields else None
+            for table, child_fields in sorted(tables.items())
+        },
+    }
+
+
+def get_unknown_template_fields(source, reference_doctype):
+    """Return the `doc.X` / `row.X` references that are neither fields nor Document attributes.
+
+    Child-table references are reported as `table.X`. Raises
+    `jinja2.TemplateSyntaxError` for invalid templates.
+    """
+    unknown = set()
+    for row_meta, table, attribute in _iter_field_references(source, reference_doctype):
+        if attribute is None or _is_projectable_field(row_meta, attribute) or hasattr(Document, attribute):
+            continue
+        unknown.add(f"{table}.{attribute}" if table else attribute)
+    return sorted(unknown)
+
+
+def _iter_field_references(source, reference_doctype):
+    """Yield `(meta, table, attribute)` for every read of `doc` or a child-table loop variable.
+
+    `table` is None for `doc` itself and `attribute` is None when the object
+    is used whole; `meta` is the doctype the attribute belongs to.
+    """
+    tree = template_environment.parse(to_whatsapp_markup(source))
+    yield from _iter_node_references(tree, None, frappe.get_meta(reference_doctype), {})
+
+
+def _iter_node_references(node, parent, meta, loop_tables):
+    """Walk `node`; `loop_tables` maps the child-table loop variables in scope to `(table, meta)`.
+
+    A `{% for %}` only binds its variable inside its own body, so two loops
+    reusing `row` over different tables each resolve `row.X` to their own table.
+    """
+    if isinstance(node, nodes.Name):
+        if node.ctx != 'load':
+            return
+        if node.name == 'doc':
+            attribute = _get_doc_attribute(parent) if parent is not None else None
+            if attribute and _is_table_field(meta, attribute):
+                # Not a tracked loop (e.g. `doc.items[0]` or `doc.items|sum`); fetch every column
+                yield frappe.get_meta(meta.get_field(attribute).options), attribute, None
+            else:
+                yield meta, None, attribute
+        elif node.name in loop_tables:
+            table, child_meta = loop_tables[node.name]
+            yield child_meta, table, _get_attribute(parent, node.name) if parent is not None else None
+        return
+
+    if isinstance(node, nodes.For):
+        # Loop variables over child tables, e.g. `item` in `{% for item in doc.items %}`
+        table = _get_doc_attribute(node.iter)
+        targets = {node.target.name} if isinstance(node.target, nodes.Name) else {
+            name.name for name in node.target.find_all(nodes.Name)
+        }
+        body_tables = {name: value for name, value in loop_tables.items() if name not in targets}
+        if table and isinstance(node.target, nodes.Name) and _is_table_field(meta, table):
+            body_tables[node.target.name] = (table, frappe.get_meta(meta.get_field(table).options))
+            yield meta, None, table
+        else:
+            yield from _iter_node_references(node.iter, node, meta, loop_tables)
+        for child in node.body + ([node.test] if node.test else []):
+            yield from _iter_node_references(child, node, meta, body_tables)
+        for child in node.else_:
+            yield from _iter_node_references(child, node, meta, loop_tables)
+        return
+
+    for child in node.iter_child_nodes():
+        yield from _iter_node_references(child, node, meta, loop_tables)
+
+
+def _get_attribute(node, name):
+    """Return X for `name.X` or `name['X']`, else None."""
+    if isinstance(node, nodes.Getattr) and isinstance(node.node, nodes.Name) and node.node.name == name:
+        return node.attr
+    if (isinstance(node, nodes.Getitem) and isinstance(node.node, nodes.Name) and node.node.name == name
+            and isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str)):
+        return node.arg.value
+    return None
+
+
+def _get_doc_attribute(node):
+    return _get_attribute(node, 'doc')
+
+
+def _is_table_field(meta, fieldname):
+    field = meta.get_field(fieldname)
+    return bool(field and field.fieldtype in frappe.model.table_fields)
+
+
+def _is_projectable_field(meta, fieldname):
+    return fieldname in default_fields or bool(meta.has_field(fieldname))
+
+
+def get_render_doc(template_doc, doctype, docname, render_only=False):
+    """Load the document for rendering `template_doc`, reading only what it uses.
+
+    Falls back to the full document when the template has no projection or,
+    unless `render_only` is set, also sends the PDF, which needs the full
+    document anyway.
+    """
+    projection = template_doc.get('referenced_fields')
+    if (template_doc.send_attachment and not render_only) or not projection:
+        return frappe.get_doc(doctype, docname)
+
+    projection = json.loads(projection) if isinstance(projection, str) else projection
+    try:
+        return _load_projected_doc(doctype, docname, projection)
+    except Exception:
+        # The doctype changed since the template was saved; render from the full document
+        return frappe.get_doc(doctype, docname)
+
+
+def _load_projected_doc(doctype, docname, projection):
+    """Build a Document holding only the projected columns and child rows.
+
+    A Document rather than a dict, so `doc.items` in a template reads the
+    `items` table and not `dict.items`.
+    """
+    values = frappe.db.get_value(doctype, docname, projection['fields'], as_dict=True)
+    if not values:
+        raise frappe.DoesNotExistError(frappe._("{0} {1} not found").format(doctype, docname))
+
+    meta = frappe.get_meta(doctype)
+    for table, child_fields in projection['tables'].items():
+        values[table] = frappe.get_all(
+            meta.get_field(table).options,
+            filters={'parent': docname, 'parenttype': doctype, 'parentfield': table},
+            fields=child_fields or ['*'],
+            order_by='idx asc',
+        )
+    return frappe.get_doc({**values, 'doctype': doctype})
@@ -0,0 +1,130 @@
+"""Local stand-ins for the WhatsApp gateway, the PDF endpoint and S3."""
+
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import boto3
+from botocore.exceptions import ClientError
+
+BENCHMARK_BUCKET = "whatsapp-benchmark"
+BENCHMARK_REGION = "us-east-1"
+DEFAULT_PDF_SIZE = 64 * 1024
+
+
+class StubHandler(BaseHTTPRequestHandler):
+	"""`POST /sendText` answers like the gateway; `GET /pdf?size=N` returns a PDF of N bytes."""
+
+	def do_POST(self):
+		if urlparse(self.path).path != "/sendText":
+			return self.send_error(404)
+		length = int(self.headers.get("Content-Length") or 0)
+		payload = json.loads(self.rfile.read(length) or b"{}")
+		self.server.wait()
+		self.server.sent += 1
+		self._reply(200, "application/json", json.dumps({"success": True, "to": payload["args"]["to"]}).encode())
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		if url.path != "/pdf":
+			return self.send_error(404)
+		size = int(parse_qs(url.query).get("size", [DEFAULT_PDF_SIZE])[0])
+		self.server.wait()
+		self._reply(200, "application/pdf", make_pdf_bytes(size))
+
+	def _reply(self, status, content_type, body):
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+class StubServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, latency=0):
+		super().__init__(("127.0.0.1", 0), StubHandler)
+		self.latency = latency
+		self.sent = 0
+
+	@property
+	def url(self):
+		return f"http://127.0.0.1:{self.server_address[1]}"
+
+	def wait(self):
+		if self.latency:
+			time.sleep(self.latency)
+
+
+@contextmanager
+def stub_server(latency=0):
+	"""Run a `StubServer` on a free local port for the duration of the block."""
+	server = StubServer(latency=latency)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield server
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+def make_pdf_bytes(size=DEFAULT_PDF_SIZE):
+	header = b"%PDF-1.4\n"
+	return header + b"0" * max(0, size - len(header))
+
+
+class InMemoryS3Client:
+	"""The subset of the S3 client API the app uses, kept in a dict."""
+
+	def __init__(self):
+		self.objects = {}
+
+	def put_object(self, Bucket, Key, Body, **kwargs):
+		body = Body if isinstance(Body, bytes | bytearray) else Body.read()
+		etag = f'"{hashlib.md5(body).hexdigest()}"'
+		self.objects[(Bucket, Key)] = (etag, bytes(body), kwargs.get("Metadata") or {})
+		return {"ETag": etag}
+
+	def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+		self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read(), **(ExtraArgs or {}))
+
+	def head_object(self, Bucket, Key):
+		if (Bucket, Key) not in self.objects:
+			raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+		etag, body, metadata = self.objects[(Bucket, Key)]
+		return {"ETag": etag, "ContentLength": len(body), "Metadata": metadata}
+
+
+@contextmanager
+def s3_stand_in():
+	"""Yield an S3 client with `BENCHMARK_BUCKET` created, backed by moto when installed."""
+	try:
+		from moto import mock_aws
+	except ImportError:
+		try:
+			from moto import mock_s3 as mock_aws
+		except ImportError:
+			mock_aws = None
+
+	if mock_aws is None:
+		yield InMemoryS3Client()
+		return
+
+	with mock_aws():
+		client = boto3.session.Session().client(
+			"s3",
+			aws_access_key_id="benchmark",
+			aws_secret_access_key="benchmark",
+			region_name=BENCHMARK_REGION,
+		)
+		client.create_bucket(Bucket=BENCHMARK_BUCKET)
+		yield client
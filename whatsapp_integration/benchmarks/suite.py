@@ -0,0 +1,236 @@
+"""Offline micro-benchmarks for the WhatsApp send path.
+
+Run against a development site; nothing leaves the machine:
+
+	bench --site dev.localhost execute whatsapp_integration.benchmarks.suite.run \
+		--kwargs "{'iterations': 500, 'output': '/tmp/wa-bench.json'}"
+
+The gateway and the PDF endpoint are served by a local stub server and S3 by
+moto (or an in-memory client when moto is not installed). Seed data is created
+on a core doctype (ToDo, with its assignee as the party) and deleted again.
+Pass `baseline` to compare against an earlier `output` file; a p95 more than
+`tolerance` slower than the baseline fails the run.
+"""
+
+import itertools
+import json
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import frappe
+import requests
+
+from whatsapp_integration.api import api
+from whatsapp_integration.benchmarks.stubs import (
+	BENCHMARK_BUCKET,
+	BENCHMARK_REGION,
+	DEFAULT_PDF_SIZE,
+	s3_stand_in,
+	stub_server,
+)
+from whatsapp_integration.whatsapp_integration.doctype.whatsapp_outbox.whatsapp_outbox import (
+	process_outbox_message,
+)
+
+BENCHMARK_DOCTYPE = "ToDo"
+BENCHMARK_TEMPLATE = "WhatsApp Benchmark"
+SAMPLE_PHONES = ("98765 43210", "+91 98765-43210", "0091 9876543210", "+1 (415) 555-2671", "0 98765 43210")
+TEMPLATE_BODY = (
+	"Hello {{ doc.allocated_to }},\n"
+	"{{ doc.description }} is due on {{ doc.date or 'soon' }} (priority: {{ doc.priority }})."
+)
+
+
+def run(iterations=200, pdf_size=DEFAULT_PDF_SIZE, latency=0, output=None, baseline=None, tolerance=0.2):
+	"""Run every benchmark and return `{name: stats}`; see the module docstring."""
+	iterations = int(iterations)
+	results = {}
+
+	with stub_server(latency=float(latency)) as server, s3_stand_in() as s3_client, benchmark_site(
+		server, s3_client, int(pdf_size)
+	) as seed:
+		phones = itertools.cycle(SAMPLE_PHONES)
+		results["format_whatsapp_phone"] = measure(
+			lambda: api.format_whatsapp_phone(next(phones)), iterations * 10
+		)
+
+		doc = frappe.get_doc(BENCHMARK_DOCTYPE, seed.docname)
+		template_doc = api.get_enabled_template(BENCHMARK_DOCTYPE)
+		results["render_template_message"] = measure(
+			lambda: api.render_template_message(template_doc, doc), iterations * 10
+		)
+
+		results["get_whatsapp_contacts"] = measure(
+			lambda: api.get_whatsapp_contacts(BENCHMARK_DOCTYPE, seed.docname), iterations
+		)
+
+		pdf_bytes = requests.get(f"{server.url}/pdf", params={"size": pdf_size}, timeout=5).content
+		results["upload_pdf_and_get_presigned_url"] = measure(
+			lambda: api.upload_pdf_and_get_presigned_url(doc, BENCHMARK_DOCTYPE, pdf_bytes), iterations
+		)
+
+		def send():
+			# A fresh key per call, or every send after the first would be deduplicated
+			queued = api.send_whatsapp_message(
+				BENCHMARK_DOCTYPE, seed.docname, seed.phone, seed.contact, idempotency_key=frappe.generate_hash()
+			)
+			process_outbox_message(queued["outbox"])
+			seed.outboxes.append(queued["outbox"])
+
+		results["send_whatsapp_message"] = measure(send, iterations)
+
+	report(results)
+	if output:
+		with open(output, "w") as f:
+			json.dump(results, f, indent=1)
+	if baseline:
+		check_regressions(results, baseline, float(tolerance))
+	return results
+
+
+def measure(fn, iterations, warmup=5):
+	"""Call `fn` repeatedly and return throughput and latency percentiles in ms."""
+	for _i in range(min(warmup, iterations)):
+		fn()
+
+	timings = []
+	started = time.perf_counter()
+	for _i in range(iterations):
+		call_started = time.perf_counter()
+		fn()
+		timings.append(time.perf_counter() - call_started)
+	elapsed = time.perf_counter() - started
+
+	timings.sort()
+	return {
+		"iterations": iterations,
+		"ops_per_sec": round(iterations / elapsed, 1) if elapsed else 0,
+		"p50_ms": percentile(timings, 50),
+		"p95_ms": percentile(timings, 95),
+		"p99_ms": percentile(timings, 99),
+		"max_ms": round(timings[-1] * 1000, 3),
+	}
+
+
+def percentile(sorted_timings, pct):
+	index = min(len(sorted_timings) - 1, round(pct / 100 * (len(sorted_timings) - 1)))
+	return round(sorted_timings[index] * 1000, 3)
+
+
+def report(results):
+	print(f"{'benchmark':<36}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+	for name, stats in results.items():
+		print(
+			f"{name:<36}{stats['ops_per_sec']:>10}{stats['p50_ms']:>10}"
+			f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+		)
+
+
+def check_regressions(results, baseline, tolerance):
+	with open(baseline) as f:
+		previous = json.load(f)
+
+	regressions = [
+		f"{name}: p95 {stats['p95_ms']} ms vs {previous[name]['p95_ms']} ms"
+		for name, stats in results.items()
+		if name in previous and stats["p95_ms"] > previous[name]["p95_ms"] * (1 + tolerance)
+	]
+	if regressions:
+		frappe.throw("<br>".join(regressions), title="WhatsApp benchmark regressions")
+
+
+@contextmanager
+def benchmark_site(server, s3_client, pdf_size):
+	"""Point the app at the stand-ins, seed a document with a contact, and clean up."""
+	settings = frappe._dict(
+		aws_access_key_id="benchmark",
+		aws_secret_access_key="benchmark",
+		bucket_name=BENCHMARK_BUCKET,
+		region_name=BENCHMARK_REGION,
+		endpoint_url=None,
+		signature_version="s3v4",
+		addressing_style=None,
+		max_pool_connections=None,
+		folder="benchmarks",
+	)
+
+	def generate_pdf_bytes(doc, doctype, print_format=None):
+		return requests.get(f"{server.url}/pdf", params={"size": pdf_size}, timeout=5).content
+
+	conf = {
+		"whatsapp_server_url": server.url,
+		"whatsapp_gateway_rate_limit": 0,
+		"whatsapp_party_fields": {BENCHMARK_DOCTYPE: {"fieldname": "allocated_to", "party_doctype": "User"}},
+	}
+	previous_conf = {key: frappe.conf.get(key) for key in conf}
+	frappe.conf.update(conf)
+
+	seed = seed_documents()
+	try:
+		with patch.object(api, "get_s3_settings", return_value=settings), patch.object(
+			api, "get_settings_s3_client", return_value=s3_client
+		), patch.object(api, "generate_pdf_bytes", generate_pdf_bytes):
+			yield seed
+	finally:
+		frappe.conf.update(previous_conf)
+		delete_seed(seed)
+
+
+def seed_documents():
+	user = frappe.session.user
+	phone = SAMPLE_PHONES[0]
+
+	contact = frappe.get_doc(
+		{
+			"doctype": "Contact",
+			"first_name": "WhatsApp",
+			"last_name": "Benchmark",
+			"phone_nos": [{"phone": phone, "is_primary_mobile_no": 1, "custom_is_whatsapp_enabled": 1}],
+			"links": [{"link_doctype": "User", "link_name": user}],
+		}
+	).insert(ignore_permissions=True)
+
+	todo = frappe.get_doc(
+		{"doctype": BENCHMARK_DOCTYPE, "description": "Benchmark invoice follow-up", "allocated_to": user}
+	).insert(ignore_permissions=True)
+
+	template_name = None
+	if not api.get_enabled_template(BENCHMARK_DOCTYPE):
+		template_name = (
+			frappe.get_doc(
+				{
+					"doctype": "Whatsapp Template",
+					"__newname": BENCHMARK_TEMPLATE,
+					"reference_doctype": BENCHMARK_DOCTYPE,
+					"enabled": 1,
+					"send_attachment": 1,
+					"response": TEMPLATE_BODY,
+				}
+			)
+			.insert(ignore_permissions=True)
+			.name
+		)
+
+	frappe.db.commit()
+	return frappe._dict(
+		docname=todo.name,
+		contact=contact.name,
+		phone=phone,
+		template=template_name,
+		outboxes=[],
+	)
+
+
+def delete_seed(seed):
+	frappe.db.rollback()
+	frappe.db.delete(
+		"Whatsapp Message Log", {"reference_doctype": BENCHMARK_DOCTYPE, "reference_name": seed.docname}
+	)
+	for outbox in seed.outboxes:
+		frappe.delete_doc("Whatsapp Outbox", outbox, force=True, ignore_permissions=True)
+	frappe.delete_doc(BENCHMARK_DOCTYPE, seed.docname, force=True, ignore_permissions=True)
+	frappe.delete_doc("Contact", seed.contact, force=True, ignore_permissions=True)
+	if seed.template:
+		frappe.delete_doc("Whatsapp Template", seed.template, force=True, ignore_permissions=True)
+	frappe.db.commit()
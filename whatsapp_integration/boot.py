@@ -0,0 +1,6 @@
+from whatsapp_integration.api.templates import get_template_doctypes
+
+
+def boot_session(bootinfo):
+	# Lets the desk decide where to show the WhatsApp button without a round trip
+	bootinfo.whatsapp_template_doctypes = get_template_doctypes()
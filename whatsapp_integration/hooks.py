@@ -85,11 +85,17 @@ app_include_js = [
 # 	"filters": "whatsapp_integration.utils.jinja_filters"
 # }
 
+# Boot
+# ----------
+
+# extend the desk boot payload
+boot_session = "whatsapp_integration.boot.boot_session"
+
 # Installation
 # ------------
 
 # before_install = "whatsapp_integration.install.before_install"
-# after_install = "whatsapp_integration.install.after_install"
+after_install = "whatsapp_integration.install.after_install"
 
 # Uninstallation
 # ------------
@@ -143,9 +149,57 @@ app_include_js = [
 # 	}
 # }
 
+doc_events = {
+	"Whatsapp Template": {
+		"on_update": [
+			"whatsapp_integration.api.templates.clear_template_resolver_cache",
+			"whatsapp_integration.api.templates.publish_template_doctypes",
+			"whatsapp_integration.api.message_log.clear_logged_doctypes_cache",
+		],
+		"after_rename": "whatsapp_integration.api.templates.clear_template_resolver_cache",
+		"on_trash": [
+			"whatsapp_integration.api.templates.clear_template_resolver_cache",
+			"whatsapp_integration.api.templates.publish_template_doctypes",
+		],
+	},
+	"Whatsapp S3 Configuration": {
+		"on_update": "whatsapp_integration.api.s3.clear_s3_client_pool",
+	},
+	"System Settings": {
+		"on_update": "whatsapp_integration.api.phone.clear_default_calling_code",
+	},
+	"DocType": {
+		"on_update": "whatsapp_integration.api.api.clear_doctype_fields_cache",
+		"on_trash": "whatsapp_integration.api.api.clear_doctype_fields_cache",
+	},
+	"Custom Field": {
+		"on_update": "whatsapp_integration.api.api.clear_doctype_fields_cache",
+		"on_trash": "whatsapp_integration.api.api.clear_doctype_fields_cache",
+	},
+	"Property Setter": {
+		"on_update": "whatsapp_integration.api.api.clear_doctype_fields_cache",
+		"on_trash": "whatsapp_integration.api.api.clear_doctype_fields_cache",
+	},
+}
+
+# Timeline
+# ---------
+# WhatsApp sends recorded in Whatsapp Message Log, shown on every form
+
+additional_timeline_content = {
+	"*": ["whatsapp_integration.api.message_log.get_timeline_content"],
+}
+
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"cron": {
+		# Flush the Whatsapp Outbox, coalescing repeated sends of the same document
+		"* * * * *": ["whatsapp_integration.api.dispatch.dispatch_outbox"],
+	},
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"whatsapp_integration.tasks.all"
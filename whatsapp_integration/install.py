@@ -0,0 +1,6 @@
+from whatsapp_integration.patches.v0_0 import add_contact_phone_whatsapp_index
+
+
+def after_install():
+	# Patches are marked as applied on install without running, so add indexes here too
+	add_contact_phone_whatsapp_index.execute()
@@ -0,0 +1,13 @@
+import frappe
+from frappe.modules.utils import sync_customizations
+
+# Composite index backing the WhatsApp contact lookup join on Contact Phone
+INDEX_NAME = "whatsapp_enabled_parent_index"
+
+
+def execute():
+	# Custom fields are synced after patches run, so make sure ours exists first
+	if not frappe.db.has_column("Contact Phone", "custom_is_whatsapp_enabled"):
+		sync_customizations("whatsapp_integration")
+
+	frappe.db.add_index("Contact Phone", ["parent", "custom_is_whatsapp_enabled"], INDEX_NAME)
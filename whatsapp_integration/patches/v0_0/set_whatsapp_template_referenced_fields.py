@@ -0,0 +1,23 @@
+import frappe
+
+from whatsapp_integration.api.templates import clear_template_resolver_cache, compile_template_source
+
+
+def execute():
+	# Templates saved before projection and signed precompilation existed fall back
+	# to the full document and to parsing at send time until this runs
+	for name in frappe.get_all("Whatsapp Template", pluck="name"):
+		template = frappe.get_doc("Whatsapp Template", name)
+		try:
+			template.set_referenced_fields()
+		except frappe.ValidationError:
+			continue
+		template.db_set(
+			{
+				"referenced_fields": template.referenced_fields,
+				"compiled_template": compile_template_source(template.get_template_source()),
+			},
+			update_modified=False,
+		)
+
+	clear_template_resolver_cache()
@@ -83,15 +83,18 @@ function send_whatsapp(frm, doctype, phone, contact_name) {
                     phone: phone,
                     contact_name: contact_name
                 },
-                freeze: true,
-                freeze_message: __('📤 Sending WhatsApp message...'),
                 callback: (r) => {
-                    if (r.message && r.message.success) {
+                    if (r.message && r.message.duplicate) {
                         frappe.show_alert({
-                            message: __('✅ Message sent to {0}!', [contact_name]),
-                            indicator: 'green'
+                            message: __('This invoice was already sent to {0} ({1})', [contact_name, __(r.message.status)]),
+                            indicator: 'orange'
                         }, 5);
-                        frm.reload_doc();
+                    } else if (r.message && r.message.success) {
+                        // Delivery runs in the background; status arrives over realtime
+                        frappe.show_alert({
+                            message: __('📤 Message to {0} queued', [contact_name]),
+                            indicator: 'blue'
+                        }, 3);
                     }
                 },
                 error: (r) => {
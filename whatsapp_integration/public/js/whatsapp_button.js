@@ -1,71 +1,204 @@
 console.log("WhatsApp button script loaded");
 
-// Cache to avoid repeated server calls
-const templateCountCache = {};
+const WHATSAPP_BUTTON_LABEL = '📱 Send via WhatsApp';
 
-// Method 1: Standard form hook
+// Doctypes with an enabled Whatsapp Template, shipped in the boot payload
+// and kept current over realtime
+function has_whatsapp_template(doctype) {
+    return (frappe.boot.whatsapp_template_doctypes || []).includes(doctype);
+}
+
+frappe.realtime.on('whatsapp_template_doctypes', (data) => {
+    if (!data) {
+        return;
+    }
+    frappe.boot.whatsapp_template_doctypes = data.doctypes || [];
+    frappe.boot.whatsapp_template_doctypes.forEach(extend_listview_settings);
+
+    if (cur_frm && cur_frm.doc && !cur_frm.doc.__islocal) {
+        if (has_whatsapp_template(cur_frm.doctype)) {
+            add_whatsapp_button(cur_frm);
+        } else {
+            cur_frm.remove_custom_button(WHATSAPP_BUTTON_LABEL);
+        }
+    }
+});
+
+// Status updates for messages queued through send_whatsapp_message
+frappe.realtime.on('whatsapp_outbox_status', (data) => {
+    if (!data) {
+        return;
+    }
+
+    const recipient = data.contact_name || data.phone;
+    if (data.status === 'Sent') {
+        frappe.show_alert({
+            message: __('✅ Message sent to {0}!', [recipient]),
+            indicator: 'green'
+        }, 5);
+    } else if (data.status === 'Failed') {
+        frappe.show_alert({
+            message: __('❌ WhatsApp message to {0} failed: {1}', [recipient, data.error || '']),
+            indicator: 'red'
+        }, 8);
+    } else if (data.status === 'Coalesced') {
+        frappe.show_alert({
+            message: __('WhatsApp message to {0} merged into a newer send', [recipient]),
+            indicator: 'blue'
+        }, 5);
+    } else {
+        frappe.show_alert({
+            message: __('WhatsApp message to {0}: {1}', [recipient, __(data.status)]),
+            indicator: 'blue'
+        }, 2);
+    }
+
+    // Refresh the timeline if the user is still on the document
+    if (data.status === 'Sent' && cur_frm && cur_frm.doctype === data.reference_doctype
+        && cur_frm.doc.name === data.reference_name) {
+        cur_frm.reload_doc();
+    }
+});
+
+// Add the button on every form refresh; Frappe clears custom buttons on refresh
 frappe.ui.form.on('*', {
     refresh(frm) {
         handle_whatsapp_button(frm);
-    },
-
-    after_save(frm) {
-        handle_whatsapp_button(frm);
     }
 });
 
-// Method 2: Override the Form class's refresh method
-(function() {
-    if (!frappe.ui.form.Form) {
+// Bulk send: add "Send via WhatsApp" to the Actions menu of list views
+(frappe.boot.whatsapp_template_doctypes || []).forEach(extend_listview_settings);
+
+// Chain our action onto the doctype's listview_settings `onload`. A doctype's
+// own *_list.js assigns its settings when the list is first opened, so the
+// entry is kept as an accessor that wraps whatever gets assigned.
+function extend_listview_settings(doctype) {
+    frappe.provide('frappe.listview_settings');
+    const descriptor = Object.getOwnPropertyDescriptor(frappe.listview_settings, doctype);
+    if (descriptor && descriptor.get) {
         return;
     }
 
-    const original_refresh = frappe.ui.form.Form.prototype.refresh;
-    
-    frappe.ui.form.Form.prototype.refresh = function() {
-        // Call original refresh first
-        const result = original_refresh.apply(this, arguments);
-        
-        
-        // Add our button logic
-        if (this.doc && !this.doc.__islocal) {
-            handle_whatsapp_button(this);
+    let settings = with_whatsapp_onload(frappe.listview_settings[doctype] || {});
+    Object.defineProperty(frappe.listview_settings, doctype, {
+        configurable: true,
+        enumerable: true,
+        get: () => settings,
+        set: (value) => {
+            settings = with_whatsapp_onload(value || {});
         }
-        
-        return result;
-    };
-    
-})();
+    });
+}
 
-// Method 3: Listen to page change events
-$(document).on('page-change', function() {
-    setTimeout(() => {
-        if (cur_frm && cur_frm.doc && !cur_frm.doc.__islocal) {
-            handle_whatsapp_button(cur_frm);
+function with_whatsapp_onload(settings) {
+    if (settings.__whatsapp_onload) {
+        return settings;
+    }
+    const onload = settings.onload;
+    settings.onload = function(listview) {
+        if (onload) {
+            onload.apply(this, arguments);
         }
-    }, 300);
-});
+        setup_whatsapp_list_action(listview);
+    };
+    settings.__whatsapp_onload = true;
+    return settings;
+}
 
-// Method 4: Watch for cur_frm changes
-(function() {
-    let lastFormId = null;
-    
-    setInterval(() => {
-        if (cur_frm && cur_frm.doc) {
-            const currentFormId = `${cur_frm.doctype}-${cur_frm.doc.name}`;
-            
-            if (currentFormId !== lastFormId) {
-                lastFormId = currentFormId;
-                
-                if (!cur_frm.doc.__islocal) {
-                    handle_whatsapp_button(cur_frm);
+function setup_whatsapp_list_action(listview) {
+    if (!listview || !listview.page || listview.__whatsapp_bulk_action_added) {
+        return;
+    }
+    if (!has_whatsapp_template(listview.doctype)) {
+        return;
+    }
+    listview.__whatsapp_bulk_action_added = true;
+
+    listview.page.add_actions_menu_item(__('Send via WhatsApp'), () => {
+        send_whatsapp_bulk(listview);
+    }, false);
+}
+
+function send_whatsapp_bulk(listview) {
+    const docnames = listview.get_checked_items(true);
+    if (!docnames.length) {
+        frappe.msgprint(__('Select at least one document to send.'));
+        return;
+    }
+
+    frappe.confirm(
+        __('Send WhatsApp messages for {0} documents to their primary WhatsApp contacts?', [docnames.length]),
+        () => {
+            frappe.call({
+                method: 'whatsapp_integration.api.bulk.send_whatsapp_bulk',
+                args: {
+                    doctype: listview.doctype,
+                    docnames: docnames
+                },
+                callback: (r) => {
+                    if (r.message && r.message.bulk_id) {
+                        frappe.show_alert({
+                            message: __('📤 Queued WhatsApp messages for {0} documents', [r.message.total]),
+                            indicator: 'blue'
+                        }, 5);
+                    }
+                    const not_permitted = (r.message && r.message.not_permitted) || [];
+                    if (not_permitted.length) {
+                        frappe.show_alert({
+                            message: __('Skipped {0} documents you do not have access to', [not_permitted.length]),
+                            indicator: 'orange'
+                        }, 8);
+                    }
                 }
-            }
+            });
         }
-    }, 1000);
-    
-    console.log("cur_frm watcher installed");
-})();
+    );
+}
+
+frappe.realtime.on('whatsapp_bulk_progress', (data) => {
+    if (data && data.total) {
+        frappe.show_progress(__('Sending WhatsApp messages'), data.done, data.total,
+            __('{0} of {1} documents processed', [data.done, data.total]), true);
+    }
+});
+
+frappe.realtime.on('whatsapp_bulk_complete', (data) => {
+    if (!data) {
+        return;
+    }
+    frappe.hide_progress();
+
+    const rows = (data.results || []).map(r => `
+        <tr>
+            <td>${frappe.utils.escape_html(r.docname || '')}</td>
+            <td>${frappe.utils.escape_html(r.contact_name || r.phone || '')}</td>
+            <td>${__(r.status)}</td>
+            <td>${frappe.utils.escape_html(r.error || '')}</td>
+        </tr>
+    `).join('');
+
+    frappe.msgprint({
+        title: __('WhatsApp Bulk Send'),
+        indicator: data.failed ? 'orange' : 'green',
+        wide: true,
+        message: `
+            <p>${__('Sent {0}, failed {1}, skipped {2} of {3} in {4}s ({5} messages/s)',
+                [data.sent, data.failed, data.skipped, data.total, data.elapsed, data.throughput])}</p>
+            <table class="table table-bordered table-sm">
+                <thead>
+                    <tr>
+                        <th>${__('Document')}</th>
+                        <th>${__('Contact')}</th>
+                        <th>${__('Status')}</th>
+                        <th>${__('Error')}</th>
+                    </tr>
+                </thead>
+                <tbody>${rows}</tbody>
+            </table>
+        `
+    });
+});
 
 function handle_whatsapp_button(frm) {
     // Skip if no form or document
@@ -78,69 +211,17 @@ function handle_whatsapp_button(frm) {
         return;
     }
 
-
-    // Check if button already exists (avoid duplicates)
-    if (frm.__whatsapp_button_added) {
-        return;
-    }
-
-    const doctype = frm.doctype;
-
-    // Check cache first
-    if (templateCountCache.hasOwnProperty(doctype)) {
-        const count = templateCountCache[doctype];
-        if (count > 0) {
-            add_whatsapp_button(frm);
-        } else {
-            console.log("No templates available for", doctype);
-        }
-        return;
+    if (has_whatsapp_template(frm.doctype)) {
+        add_whatsapp_button(frm);
     }
-
-    // Fetch template count
-    console.log("Fetching template count for", doctype);
-    frappe.call({
-        method: 'frappe.client.get_count',
-        args: {
-            doctype: 'Whatsapp Template',
-            filters: {
-                reference_doctype: doctype,
-                enabled: 1
-            }
-        },
-        callback: (r) => {
-            const count = (r && typeof r.message === 'number') ? r.message : 0;
-            
-            // Cache the result
-            templateCountCache[doctype] = count;
-            
-            if (count > 0) {
-                add_whatsapp_button(frm);
-            } else {
-                console.log("No templates available for", doctype);
-            }
-        },
-        error: (r) => {
-            console.error("Error fetching template count:", r);
-        }
-    });
 }
 
 function add_whatsapp_button(frm) {
     try {
-        // Double-check we haven't already added it
-        if (frm.__whatsapp_button_added) {
-            return;
-        }
-        
-        // Add as a top-level custom button
-        frm.add_custom_button('📱 Send via WhatsApp', () => {
+        // Add as a top-level custom button (re-adding replaces the existing one)
+        frm.add_custom_button(WHATSAPP_BUTTON_LABEL, () => {
             show_whatsapp_dialog(frm, frm.doctype);
         });
-        
-        // Mark as added
-        frm.__whatsapp_button_added = true;
-        
     } catch (e) {
         console.error('❌ Failed to add WhatsApp button:', e);
     }
@@ -219,7 +300,8 @@ function send_whatsapp(frm, doctype, phone, contact_name) {
         freeze: true,
         freeze_message: __('🧩 Preparing WhatsApp message and link...'),
         callback: (r) => {
-            let msg = r.message && r.message.message ? r.message.message : '';
+            // Already WhatsApp markup: HTML templates are converted on the server
+            const msg = r.message && r.message.message ? r.message.message : '';
             if (!msg) {
                 frappe.msgprint({
                     title: __('No Message'),
@@ -229,16 +311,6 @@ function send_whatsapp(frm, doctype, phone, contact_name) {
                 return;
             }
 
-            // If template is HTML, strip tags to plain text
-            const isHtml = r.message && r.message.is_html;
-            if (isHtml || /<\/?[a-z][\s\S]*>/i.test(msg)) {
-                const tmp = document.createElement('div');
-                tmp.innerHTML = msg;
-                tmp.querySelectorAll('br').forEach(br => br.replaceWith('\n'));
-                msg = tmp.textContent || tmp.innerText || '';
-                msg = msg.replace(/[\t\x0B\f\r ]+/g, ' ').replace(/\n\s+/g, '\n').trim();
-            }
-
             const encoded = encodeURIComponent(msg);
             const url = `https://wa.me/${normalizedPhone}?text=${encoded}`;
 
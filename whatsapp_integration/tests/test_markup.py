@@ -0,0 +1,61 @@
+# Copyright (c) 2026, Vaishali Sahni and Contributors
+# See license.txt
+
+from frappe.tests import UnitTestCase
+
+from whatsapp_integration.api.markup import html_to_whatsapp, is_html, to_whatsapp_markup
+from whatsapp_integration.api.templates import template_environment
+
+
+class UnitTestWhatsAppMarkup(UnitTestCase):
+	def test_plain_text_is_unchanged(self):
+		self.assertFalse(is_html("Total: 5 < 10"))
+		self.assertEqual(to_whatsapp_markup("Hello {{ doc.name }}\nBye"), "Hello {{ doc.name }}\nBye")
+		self.assertEqual(to_whatsapp_markup(None), "")
+
+	def test_inline_formatting(self):
+		self.assertEqual(
+			html_to_whatsapp("<p><b>Bold</b>, <em>italic</em>, <del>gone</del> and <code>x = 1</code></p>"),
+			"*Bold*, _italic_, ~gone~ and ```x = 1```",
+		)
+		# Markers hug the text, or WhatsApp does not format it
+		self.assertEqual(html_to_whatsapp("<p>Total:<strong> 42 </strong>due</p>"), "Total: *42* due")
+
+	def test_blocks_and_line_breaks(self):
+		self.assertEqual(
+			html_to_whatsapp("<h3>Invoice</h3><p>Line one<br>Line two</p><div>Next</div>"),
+			"*Invoice*\nLine one\nLine two\nNext",
+		)
+
+	def test_lists(self):
+		self.assertEqual(
+			html_to_whatsapp("<ul><li>Pen</li><li>Ink<ol><li>Blue</li><li>Red</li></ol></li></ul>"),
+			"• Pen\n• Ink\n  1. Blue\n  2. Red",
+		)
+
+	def test_links(self):
+		self.assertEqual(
+			html_to_whatsapp('<p>Pay <a href="https://pay.example/1">here</a></p>'),
+			"Pay here (https://pay.example/1)",
+		)
+		self.assertEqual(
+			html_to_whatsapp('<a href="https://pay.example/1">https://pay.example/1</a>'),
+			"https://pay.example/1",
+		)
+
+	def test_jinja_tags_pass_through(self):
+		self.assertEqual(
+			html_to_whatsapp(
+				"<p>Dear <strong>{{ doc.customer_name }}</strong>,</p>"
+				"{% if doc.grand_total &gt; 0 %}<p>Due: {{ doc.grand_total }}</p>{% endif %}"
+			),
+			"Dear *{{ doc.customer_name }}*,\n{% if doc.grand_total > 0 %}\nDue: {{ doc.grand_total }}\n{% endif %}",
+		)
+
+	def test_html_field_values_are_converted(self):
+		template = template_environment.from_string("Ship to:\n{{ doc.address_display }}")
+		self.assertEqual(
+			template.render(doc={"address_display": "Street 1<br>Acme &amp; Co<br>"}),
+			"Ship to:\nStreet 1\nAcme & Co",
+		)
+		self.assertEqual(template_environment.from_string("{{ 5 }} < {{ 'a < b' }}").render(), "5 < a < b")
@@ -0,0 +1,43 @@
+# Copyright (c) 2026, Vaishali Sahni and Contributors
+# See license.txt
+
+from frappe.tests import UnitTestCase
+
+from whatsapp_integration.api.phone import PhoneNumberError, match_calling_code, normalize, normalize_many
+
+
+class UnitTestPhoneNormalizer(UnitTestCase):
+	def test_national_numbers_get_default_code(self):
+		self.assertEqual(normalize("98765 43210", "91"), "919876543210")
+		self.assertEqual(normalize("0 98765 43210", "91"), "919876543210")
+		# Starts like Russia's +7 but is a bare national number
+		self.assertEqual(normalize("7987654321", "91"), "917987654321")
+
+	def test_numbers_with_country_code(self):
+		self.assertEqual(normalize("919876543210", "91"), "919876543210")
+		self.assertEqual(normalize("+91 98765-43210", "91"), "919876543210")
+		self.assertEqual(normalize("0091 9876543210", "91"), "919876543210")
+		self.assertEqual(normalize("+1 (415) 555-2671", "91"), "14155552671")
+
+	def test_international_prefix_is_trusted(self):
+		# Eight-digit national numbers must not be mistaken for ten-digit Indian ones
+		self.assertEqual(normalize("+65 9123 4567", "91"), "6591234567")
+		self.assertEqual(normalize("0065 9123 4567", "91"), "6591234567")
+		self.assertEqual(normalize("+852 9123 4567", "91"), "85291234567")
+		self.assertEqual(normalize("(+44) 20 7946 0958", "91"), "442079460958")
+
+	def test_invalid_numbers(self):
+		for phone in ("", "abc", "12345", "+999 1234567", "1234567890123456"):
+			with self.subTest(phone=phone), self.assertRaises(PhoneNumberError):
+				normalize(phone, "91")
+
+	def test_match_calling_code(self):
+		self.assertEqual(match_calling_code("6591234567"), "65")
+		self.assertEqual(match_calling_code("8529"), "852")
+		self.assertIsNone(match_calling_code("999"))
+
+	def test_normalize_many(self):
+		(valid, valid_error), (invalid, invalid_error) = normalize_many(["+65 9123 4567", "12"], "91")
+		self.assertEqual((valid, valid_error), ("6591234567", None))
+		self.assertIsNone(invalid)
+		self.assertTrue(invalid_error)
@@ -0,0 +1,137 @@
+# Copyright (c) 2026, Vaishali Sahni and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.core.doctype.doctype.test_doctype import new_doctype
+from frappe.tests import IntegrationTestCase
+
+from whatsapp_integration.api import templates
+from whatsapp_integration.api.templates import (
+	CompiledTemplateCache,
+	_load_projected_doc,
+	compile_template_source,
+	get_template_field_projection,
+	get_unknown_template_fields,
+	load_compiled_template,
+	template_environment,
+)
+
+PARENT_DOCTYPE = "WhatsApp Test Order"
+CHILD_DOCTYPE = "WhatsApp Test Order Item"
+TAX_DOCTYPE = "WhatsApp Test Order Tax"
+
+# `items`, like the Sales Invoice and Sales Order tables, shares its name with `dict.items`
+ITEMS_TEMPLATE = (
+	"{{ doc.customer_name }}:{% for item in doc.items %} {{ item.item_name }} x{{ item.qty }}{% endfor %}"
+)
+
+# The table is also read outside the loop, so `rate` must be fetched too
+MIXED_ACCESS_TEMPLATE = (
+	"{% for it in doc.items %}{{ it.qty }} {% endfor %}"
+	"{{ doc.items[0].rate }} {{ doc.items|sum(attribute='rate') }}"
+)
+
+# Two tables looped with the same variable, as the Insert Field snippets do
+SHARED_ROW_TEMPLATE = (
+	"{% for row in doc.items %}{{ row.qty }}{% endfor %}"
+	"{% for row in doc.taxes %}{{ row.tax_amount }}{% endfor %}"
+)
+
+
+class IntegrationTestTemplateProjection(IntegrationTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		if not frappe.db.exists("DocType", CHILD_DOCTYPE):
+			new_doctype(
+				CHILD_DOCTYPE,
+				istable=1,
+				fields=[
+					{"fieldname": "item_name", "fieldtype": "Data", "label": "Item Name"},
+					{"fieldname": "qty", "fieldtype": "Int", "label": "Qty"},
+					{"fieldname": "rate", "fieldtype": "Float", "label": "Rate"},
+				],
+			).insert()
+		if not frappe.db.exists("DocType", PARENT_DOCTYPE):
+			new_doctype(
+				PARENT_DOCTYPE,
+				fields=[
+					{"fieldname": "customer_name", "fieldtype": "Data", "label": "Customer Name"},
+					{"fieldname": "items", "fieldtype": "Table", "label": "Items", "options": CHILD_DOCTYPE},
+					{"fieldname": "taxes", "fieldtype": "Table", "label": "Taxes", "options": TAX_DOCTYPE},
+				],
+			).insert()
+
+	def test_projection_of_items_loop(self):
+		projection = get_template_field_projection(ITEMS_TEMPLATE, PARENT_DOCTYPE)
+		self.assertEqual(projection["fields"], ["customer_name", "name"])
+		self.assertEqual(projection["tables"], {"items": ["item_name", "qty"]})
+
+	def test_loop_variable_is_scoped_to_its_loop(self):
+		self.assertEqual(get_unknown_template_fields(SHARED_ROW_TEMPLATE, PARENT_DOCTYPE), [])
+		self.assertEqual(
+			get_template_field_projection(SHARED_ROW_TEMPLATE, PARENT_DOCTYPE)["tables"],
+			{"items": ["qty"], "taxes": ["tax_amount"]},
+		)
+
+	def test_table_used_outside_loop_fetches_all_columns(self):
+		projection = get_template_field_projection(MIXED_ACCESS_TEMPLATE, PARENT_DOCTYPE)
+		self.assertEqual(projection["tables"], {"items": None})
+
+		doc = frappe.get_doc(
+			{
+				"doctype": PARENT_DOCTYPE,
+				"items": [
+					{"item_name": "Pen", "qty": 2, "rate": 1.5},
+					{"item_name": "Ink", "qty": 1, "rate": 2},
+				],
+			}
+		).insert()
+		projected = _load_projected_doc(PARENT_DOCTYPE, doc.name, projection)
+		self.assertEqual(
+			template_environment.from_string(MIXED_ACCESS_TEMPLATE).render(doc=projected), "2 1 1.5 3.5"
+		)
+
+	def test_render_items_loop_from_projected_doc(self):
+		doc = frappe.get_doc(
+			{
+				"doctype": PARENT_DOCTYPE,
+				"customer_name": "Acme",
+				"some_fieldname": "not projected",
+				"items": [{"item_name": "Pen", "qty": 2}, {"item_name": "Ink", "qty": 1}],
+			}
+		).insert()
+
+		projected = _load_projected_doc(
+			PARENT_DOCTYPE, doc.name, get_template_field_projection(ITEMS_TEMPLATE, PARENT_DOCTYPE)
+		)
+
+		self.assertIsNone(projected.get("some_fieldname"))
+		self.assertEqual(
+			template_environment.from_string(ITEMS_TEMPLATE).render(doc=projected), "Acme: Pen x2 Ink x1"
+		)
+
+
+class IntegrationTestCompiledTemplates(IntegrationTestCase):
+	source = "Hello {{ doc.name }}"
+
+	def test_cache_miss_loads_stored_code(self):
+		compiled = compile_template_source(self.source)
+
+		with patch.object(templates, "load_compiled_template", wraps=load_compiled_template) as loader:
+			template = CompiledTemplateCache().get(
+				(frappe.local.site, "Test", "1", "response"), self.source, compiled
+			)
+
+		loader.assert_called_once_with(self.source, compiled)
+		self.assertEqual(template.render(doc={"name": "X"}), "Hello X")
+
+	def test_tampered_code_is_not_executed(self):
+		compiled = compile_template_source(self.source)
+		header, code = compiled.split("\n", 1)
+
+		self.assertIsNotNone(load_compiled_template(self.source, compiled))
+		self.assertIsNone(load_compiled_template(self.source, f"{header}\nimport os\n{code}"))
+		self.assertIsNone(load_compiled_template(self.source, header.split(" sig ")[0] + "\n" + code))
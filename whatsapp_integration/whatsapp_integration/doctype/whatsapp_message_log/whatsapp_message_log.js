@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Vaishali Sahni and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Whatsapp Message Log", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,124 @@
+# Copyright (c) 2026, Vaishali Sahni and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+from whatsapp_integration.api.api import deliver_whatsapp_message
+from whatsapp_integration.api.bulk import get_bulk_workers, run_in_worker_pool
+from whatsapp_integration.api.dispatch import get_dispatch_window
+from whatsapp_integration.api.message_log import insert_message_logs
+from whatsapp_integration.api.templates import get_enabled_template, get_render_doc
+
+# Realtime event pushed to the sender on every status change
+OUTBOX_STATUS_EVENT = "whatsapp_outbox_status"
+
+
+class WhatsappOutbox(Document):
+	def before_insert(self):
+		if not get_dispatch_window():
+			# Enqueued right away; `dispatch.dispatch_outbox` only picks it up if the job is lost
+			self.dispatched_on = now_datetime()
+
+	def after_insert(self):
+		self.publish_status(after_commit=True)
+		if get_dispatch_window():
+			# Coalesced with later sends and flushed by `dispatch.dispatch_outbox`
+			return
+
+		frappe.enqueue(
+			"whatsapp_integration.whatsapp_integration.doctype.whatsapp_outbox.whatsapp_outbox.process_outbox_message",
+			queue="short",
+			job_id=f"whatsapp_outbox::{self.name}",
+			deduplicate=True,
+			enqueue_after_commit=True,
+			outbox_name=self.name,
+		)
+
+	def update_status(self, status, **values):
+		"""Persist a status change immediately and notify the sender."""
+		values["status"] = status
+		self.db_set(values, update_modified=False, commit=True)
+		self.publish_status()
+
+	def publish_status(self, after_commit=False):
+		frappe.publish_realtime(
+			OUTBOX_STATUS_EVENT,
+			{
+				"outbox": self.name,
+				"status": self.status,
+				"reference_doctype": self.reference_doctype,
+				"reference_name": self.reference_name,
+				"phone": self.phone,
+				"contact_name": self.contact_name,
+				"error": self.error,
+			},
+			user=self.owner,
+			after_commit=after_commit,
+		)
+
+
+def process_outbox_message(outbox_name, message_log=None):
+	"""Background job: render, upload and send one queued message.
+
+	`message_log` collects the Whatsapp Message Log row instead of writing it;
+	see `deliver_whatsapp_message`.
+	"""
+	outbox = frappe.get_doc("Whatsapp Outbox", outbox_name)
+	if outbox.status != "Queued":
+		return
+
+	try:
+		template_doc = get_enabled_template(outbox.reference_doctype)
+		if not template_doc:
+			frappe.throw(_("No WhatsApp template found for {0}").format(outbox.reference_doctype))
+		doc = get_render_doc(template_doc, outbox.reference_doctype, outbox.reference_name)
+
+		result = deliver_whatsapp_message(
+			doc,
+			template_doc,
+			outbox.phone,
+			outbox.contact_name,
+			on_stage=outbox.update_status,
+			message_log=message_log,
+			outbox=outbox.name,
+			# Dispatched batches run as the scheduler; log the user who queued the message
+			sender=outbox.owner,
+		)
+	except Exception as e:
+		# Roll back first: the Error Log rows written on the way out would go with it
+		traceback = frappe.get_traceback()
+		frappe.db.rollback()
+		frappe.log_error(
+			title="WhatsApp Outbox",
+			message=traceback,
+			reference_doctype=outbox.reference_doctype,
+			reference_name=outbox.reference_name,
+		)
+		outbox.update_status("Failed", error=str(e))
+		return
+
+	outbox.update_status(
+		"Sent",
+		sent_on=now_datetime(),
+		response=json.dumps((result or {}).get("response"), default=str),
+	)
+
+
+def process_outbox_batch(outbox_names):
+	"""Background job: send a batch of dispatched messages through the bulk worker pool."""
+	# Log rows of the whole batch, written in one insert at the end
+	message_log = []
+	try:
+		run_in_worker_pool(
+			[(outbox_name, message_log) for outbox_name in outbox_names],
+			process_outbox_message,
+			max_workers=get_bulk_workers(),
+		)
+	finally:
+		insert_message_logs(message_log)
+		frappe.db.commit()
@@ -1,9 +1,70 @@
 # Copyright (c) 2025, Vaishali Sahni and contributors
 # For license information, please see license.txt
 
-# import frappe
+import json
+
+import frappe
+from frappe import _
 from frappe.model.document import Document
+from jinja2 import TemplateSyntaxError
+
+from whatsapp_integration.api.templates import (
+	clear_compiled_template_cache,
+	compile_template_source,
+	get_template_field_projection,
+	get_unknown_template_fields,
+)
 
 
 class WhatsappTemplate(Document):
-	pass
+	def validate(self):
+		self.validate_single_enabled_template()
+		self.validate_template_fields()
+		self.compiled_template = compile_template_source(self.get_template_source())
+		self.set_referenced_fields()
+
+	def on_update(self):
+		clear_compiled_template_cache(self.name)
+
+	def on_trash(self):
+		clear_compiled_template_cache(self.name)
+
+	def get_template_source(self):
+		return self.response_html if self.use_html else self.response
+
+	def validate_single_enabled_template(self):
+		if not self.enabled:
+			return
+
+		existing = frappe.db.exists(
+			"Whatsapp Template",
+			{"reference_doctype": self.reference_doctype, "enabled": 1, "name": ("!=", self.name)},
+		)
+		if existing:
+			frappe.throw(
+				_("Whatsapp Template {0} is already enabled for {1}. Disable it first.").format(
+					frappe.bold(existing), frappe.bold(self.reference_doctype)
+				)
+			)
+
+	def validate_template_fields(self):
+		"""Compile-check the template and reject references to fields the doctype doesn't have."""
+		try:
+			unknown = get_unknown_template_fields(self.get_template_source(), self.reference_doctype)
+		except TemplateSyntaxError as e:
+			frappe.throw(_("Invalid template syntax on line {0}: {1}").format(e.lineno, e.message))
+
+		if unknown:
+			frappe.throw(
+				_("Unknown fields for {0}: {1}").format(
+					frappe.bold(self.reference_doctype), ", ".join(frappe.bold(f) for f in unknown)
+				)
+			)
+
+	def set_referenced_fields(self):
+		"""Store the columns the template reads so sends can skip loading the full document."""
+		try:
+			projection = get_template_field_projection(self.get_template_source(), self.reference_doctype)
+		except TemplateSyntaxError as e:
+			frappe.throw(_("Invalid template syntax on line {0}: {1}").format(e.lineno, e.message))
+		self.referenced_fields = json.dumps(projection) if projection else None